@@ -0,0 +1,98 @@
+"""
+Adaptive Classifier-Free Guidance
+Classifier-free guidance runs the UNet on a doubled batch (with and without
+the prompt) at every step. Late in the schedule the two noise predictions
+have mostly converged and guidance barely moves the image, so the
+unconditional half can be dropped: after a fixed fraction of the steps (CFG
+truncation), or as soon as the predictions point the same way (adaptive
+guidance). Every step after that costs one UNet evaluation instead of two.
+
+Convergence is the cosine similarity of the conditional and unconditional
+predictions, read from the UNet output of each guided step.
+
+Based on Castillo et al., "Adaptive Guidance: Training-free Acceleration of
+Conditional Diffusion Models" (2023).
+"""
+
+import torch
+
+# Cosine similarity of the two predictions at which adaptive guidance stops
+GUIDANCE_THRESHOLD = 0.991
+
+# Pipeline tensors whose unconditional half is dropped with guidance
+GUIDANCE_TENSORS = ["prompt_embeds", "add_text_embeds", "add_time_ids"]
+
+
+class AdaptiveGuidance:
+    """Context manager that drops an SDXL pipeline's unconditional branch part-way
+
+    cutoff is the fraction of steps that keep guidance (1 keeps it
+    throughout); threshold, if set, also stops guidance once the
+    predictions are at least that similar. Call step_end from the
+    pipeline's callback_on_step_end with GUIDANCE_TENSORS as its tensor
+    inputs.
+    """
+
+    def __init__(self, unet, cutoff=1.0, threshold=None):
+        if not 0 < cutoff <= 1:
+            raise ValueError(f"Guidance cutoff must be in (0, 1], got {cutoff}")
+        if threshold is not None and not -1 <= threshold <= 1:
+            raise ValueError(f"Guidance threshold is a cosine similarity in [-1, 1], got {threshold}")
+        self.unet = unet
+        self.cutoff = cutoff
+        self.threshold = threshold
+        self.guided = True
+        self.similarity = None  # of the last guided step
+        self.guided_steps = 0
+        self.unguided_steps = 0
+        self.saved_forward = None
+
+    @property
+    def unet_evaluations(self):
+        """UNet evaluations per image (a guided step costs two)"""
+        return 2 * self.guided_steps + self.unguided_steps
+
+    @property
+    def saved_evaluations(self):
+        """Evaluations saved against guidance on every step"""
+        return self.unguided_steps
+
+    def __enter__(self):
+        self.saved_forward = self.unet.__dict__.get("forward")
+        self.unet.forward = self._wrap_unet(self.unet.forward)
+        return self
+
+    def __exit__(self, *exc):
+        if self.saved_forward is None:
+            del self.unet.forward
+        else:
+            self.unet.forward = self.saved_forward
+
+    def _wrap_unet(self, forward):
+        def guidance_unet_forward(sample, *args, **kwargs):
+            output = forward(sample, *args, **kwargs)
+            if not self.guided:
+                self.unguided_steps += 1
+            else:
+                self.guided_steps += 1
+                if self.threshold is not None:
+                    noise = output[0] if isinstance(output, tuple) else output.sample
+                    uncond, text = noise.float().flatten(1).chunk(2)
+                    self.similarity = torch.nn.functional.cosine_similarity(uncond, text).min().item()
+            return output
+
+        return guidance_unet_forward
+
+    def step_end(self, pipe, step, callback_kwargs):
+        """Drop the unconditional branch once the schedule says so"""
+        if not self.guided or not pipe.do_classifier_free_guidance:
+            return callback_kwargs
+        done = step + 1
+        converged = self.threshold is not None and self.similarity is not None and self.similarity >= self.threshold
+        if done >= int(pipe.num_timesteps * self.cutoff) or converged:
+            # The pipeline stacks (unconditional, conditional); keep the conditional half
+            for name in GUIDANCE_TENSORS:
+                callback_kwargs[name] = callback_kwargs[name].chunk(2)[1]
+            pipe._guidance_scale = 0.0
+            self.guided = False
+        return callback_kwargs
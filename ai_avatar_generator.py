@@ -9,16 +9,39 @@ Features:
 - Pixel art style via LoRA
 """
 
+import argparse
+import hashlib
+import logging
 import pygame
+import random
+import sqlite3
 import sys
+import time
 from datetime import datetime
 from pathlib import Path
 import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+
+import fantasy_avatar_generator
+from deep_cache import DeepCache
+from generation_cache import GenerationCache, make_cache_key
+from generation_history import THUMB_SIZE, GenerationHistory
+from generation_metrics import GenerationMetrics
+from lora_registry import LoraRegistry
+from PIL import Image
 
 # Import AI libraries
 try:
-    from diffusers import StableDiffusionXLPipeline
+    from diffusers import StableDiffusionXLImg2ImgPipeline, StableDiffusionXLPipeline
+    from diffusers.pipelines.stable_diffusion_xl.pipeline_stable_diffusion_xl_img2img import retrieve_latents
     import torch
+
+    from adaptive_guidance import GUIDANCE_TENSORS, GUIDANCE_THRESHOLD, AdaptiveGuidance
+    from autotune import apply_profile, load_profile, profile_dtype
+    from memory_governor import MemoryGovernor
+    from tiny_vae import TINY_VAE_PATH, load_tiny_vae, tiny_scale_factor
+    from token_merging import TokenMerging
 except ImportError as e:
     print("❌ Required libraries not installed!")
     print(f"Missing: {e}")
@@ -31,9 +54,48 @@ SCREEN_HEIGHT = 700
 AVATAR_SIZE = 512
 AVATAR_Y_OFFSET = 50
 
+# Base model
+MODEL_ID = "stabilityai/stable-diffusion-xl-base-1.0"
+
+# LoRA style applied when a request does not name one
+DEFAULT_STYLE = "pixel-art"
+
+# Default generation parameters
+NUM_INFERENCE_STEPS = 30
+GUIDANCE_SCALE = 7.5
+IMAGE_SIZE = 1024
+
+# Fraction of the denoising schedule re-run for variations of an existing image
+VARIATION_STRENGTH = 0.35
+
+# Fraction of the schedule run on top of a procedural avatar in guided mode;
+# the layout fixes the composition, so fewer steps are needed than from noise
+GUIDE_STRENGTH = 0.6
+
+# Final latents kept in memory so variations can skip the VAE encode
+LATENT_CACHE_SIZE = 16
+
 # Debug logging toggle
 DEBUG = False
 
+# Denoising progress is logged at INFO every N steps (every step at DEBUG)
+PROGRESS_LOG_INTERVAL = 10
+
+logger = logging.getLogger("ai_avatar_generator")
+
+# When to start loading the model before the first Generate click:
+#   "eager"     - right after the window opens
+#   "keystroke" - on the first keystroke in the prompt box
+#   "idle"      - once the user has started typing and then paused for PRELOAD_IDLE_MS
+#   "click"     - only when Generate is first pressed
+PRELOAD_POLICIES = ("eager", "keystroke", "idle", "click")
+PRELOAD_POLICY = "idle"
+PRELOAD_IDLE_MS = 1500
+
+# History gallery: spacing around thumbnails and how many decoded thumbnails to keep
+GALLERY_PADDING = 8
+GALLERY_CACHE_SIZE = 32
+
 # Colors
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
@@ -45,13 +107,91 @@ HOVER_BLUE = (90, 150, 240)
 GREEN = (80, 200, 120)
 
 
+class GenerationRequest:
+    """One generation as it moves through the prepare, denoise and decode stages"""
+
+    def __init__(
+        self,
+        prompt,
+        negative_prompt,
+        seed,
+        *,
+        num_inference_steps,
+        guidance_scale,
+        width,
+        height,
+        loras,
+        queued_at,
+        deepcache_interval=1,
+        token_merging=0.0,
+        guidance_cutoff=1.0,
+        guidance_threshold=None,
+        full_vae=False,
+        init=None,
+        init_key=None,
+        strength=None,
+    ):
+        self.prompt = prompt
+        self.negative_prompt = negative_prompt
+        self.seed = seed
+        self.num_inference_steps = num_inference_steps
+        self.guidance_scale = guidance_scale
+        self.width = width
+        self.height = height
+        self.loras = loras
+        self.queued_at = queued_at
+        self.deepcache_interval = deepcache_interval
+        self.token_merging = token_merging
+        self.guidance_cutoff = guidance_cutoff
+        self.guidance_threshold = guidance_threshold
+        self.full_vae = full_vae
+        self.init = init
+        self.init_key = init_key
+        self.strength = strength
+        # Filled in by the stages
+        self.job = None
+        self.latents = None
+        self.image = None
+
+
 class AIAvatarGenerator:
     """AI-powered pixel art fantasy character generator using Stable Diffusion with LoRA"""
 
-    def __init__(self, lora_path="pixel-art-xl-v1.1.safetensors"):
+    def __init__(
+        self,
+        lora_path="pixel-art-xl-v1.1.safetensors",
+        model_id=MODEL_ID,
+        cache=None,
+        metrics=None,
+        mmap_weights=False,
+        profile=None,
+        tiny_vae=None,
+    ):
         self.lora_path = Path(lora_path)
+        self.model_id = model_id
+        # On CPU, map weights from disk so several processes share one copy
+        self.mmap_weights = mmap_weights
+        # Optional tiny autoencoder (local file or directory) that decodes final images
+        self.tiny_vae_path = None if tiny_vae is None else Path(tiny_vae)
+        self.tiny_vae = None
+        self.loras = LoraRegistry()
+        self.loras.register(DEFAULT_STYLE, self.lora_path)
+        self.loras.load_config()
+        # Pass cache=False to disable result caching
+        self.cache = GenerationCache() if cache is None else cache
+        self.metrics = metrics or GenerationMetrics()
+        self.last_seed = None
+        self.latent_cache = OrderedDict()  # result cache key -> final latents
+        self.layouts = None  # procedural AvatarGenerator for guided mode, created on first use
+        # The VAE is shared by decoding and img2img encoding, which may overlap
+        self.vae_lock = threading.Lock()
         self.pipeline = None
+        self.img2img_pipeline = None
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.memory = MemoryGovernor(self.device)
+        # Tuned settings from autotune.py; pass profile=False for the built-in defaults
+        self.profile = load_profile(self.device) if profile is None else profile
+        self.profile_config = None  # what of the profile took effect once loaded
         self.is_loading = False
         self.is_generating = False
         self.model_loaded = False
@@ -62,7 +202,6 @@ class AIAvatarGenerator:
         if self.device == "cpu":
             print("⚠️  Warning: Using CPU. Generation will be slow (2-5 minutes per image)")
             print("   For better performance, use a CUDA-compatible GPU")
-    # Generation is text-only; no external image inputs
 
     def load_model(self):
         """Load Stable Diffusion XL model with LoRA"""
@@ -75,28 +214,59 @@ class AIAvatarGenerator:
 
         try:
             # Load base SDXL model
-            model_id = "stabilityai/stable-diffusion-xl-base-1.0"
+            mmapped = self.mmap_weights and self.device == "cpu"
+            if mmapped:
+                from mmap_weights import load_mmap_pipeline
 
-            self.pipeline = StableDiffusionXLPipeline.from_pretrained(
-                model_id,
-                torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-                use_safetensors=True,
-                variant="fp16" if self.device == "cuda" else None,
-            )
+                print("🗺️  Memory-mapping model weights")
+                self.pipeline = load_mmap_pipeline(self.model_id)
+            else:
+                if self.profile:
+                    dtype = profile_dtype(self.profile)
+                else:
+                    dtype = torch.float16 if self.device == "cuda" else torch.float32
+                self.pipeline = StableDiffusionXLPipeline.from_pretrained(
+                    self.model_id,
+                    torch_dtype=dtype,
+                    use_safetensors=True,
+                    # Half-precision weights are published as the fp16 variant
+                    variant="fp16" if dtype in (torch.float16, torch.bfloat16) else None,
+                )
 
             self.pipeline = self.pipeline.to(self.device)
+            # Variations reuse the already-loaded components; nothing is loaded twice
+            self.img2img_pipeline = StableDiffusionXLImg2ImgPipeline(**self.pipeline.components)
 
             # Load LoRA weights if file exists
             if self.lora_path.exists():
                 print(f"🎨 Loading LoRA model: {self.lora_path}")
-                self.pipeline.load_lora_weights(".", weight_name=str(self.lora_path))
+                self.loras.activate(self.pipeline, self.default_loras())
                 print("✅ LoRA model loaded successfully!")
             else:
                 print(f"⚠️  LoRA file not found: {self.lora_path}")
                 print("   Continuing with base SDXL model (results may vary)")
 
+            # Load the fast approximate decoder if one was asked for
+            if self.tiny_vae_path is not None:
+                if self.tiny_vae_path.exists():
+                    tiny_vae = load_tiny_vae(self.tiny_vae_path, self.device, self.pipeline.vae.dtype)
+                    if tiny_scale_factor(tiny_vae) == self.pipeline.vae_scale_factor:
+                        self.tiny_vae = tiny_vae
+                        print(f"✅ Tiny VAE decoder loaded: {self.tiny_vae_path}")
+                    else:
+                        print(f"⚠️  {self.tiny_vae_path} does not match this model's VAE; decoding with the full VAE")
+                else:
+                    print(f"⚠️  Tiny VAE not found: {self.tiny_vae_path}; decoding with the full VAE")
+
+            if self.profile:
+                # Weights were loaded in the profile's dtype; memory-mapped ones stay float32
+                # and keep their layout so worker processes go on sharing the pages
+                self.profile_config = apply_profile(
+                    self.pipeline, self.profile, convert_dtype=False, convert_layout=not mmapped
+                )
+                print(f"⚙️  Applied tuned profile: {self.profile_config}")
             # Enable memory optimizations
-            if self.device == "cuda":
+            elif self.device == "cuda":
                 self.pipeline.enable_attention_slicing()
                 # Try to enable xformers for faster generation
                 try:
@@ -115,8 +285,160 @@ class AIAvatarGenerator:
             self.is_loading = False
             print(f"📊 Model loading complete: model_loaded={self.model_loaded}, is_loading={self.is_loading}")
 
-    def generate_avatar(self, prompt, negative_prompt=None):
-        """Generate pixel-art fantasy character from text prompt"""
+    def avatar_request(
+        self,
+        prompt,
+        negative_prompt=None,
+        seed=None,
+        num_inference_steps=NUM_INFERENCE_STEPS,
+        guidance_scale=GUIDANCE_SCALE,
+        width=IMAGE_SIZE,
+        height=IMAGE_SIZE,
+        loras=None,
+        queued_at=None,
+        deepcache_interval=1,
+        token_merging=0.0,
+        guidance_cutoff=1.0,
+        guidance_threshold=None,
+        full_vae=False,
+    ):
+        """Describe a text-to-image generation; run it with run_request
+
+        The same seed and parameters always produce the same image; results
+        are served from the generation cache when available. Without a seed a
+        random one is picked and recorded in self.last_seed. loras selects
+        LoRA styles for this request: a registered name, a list of names or a
+        {name: weight} dict (None means the default style, {} means none).
+        queued_at is the time.perf_counter() value when the request was made,
+        for queue-wait metrics. deepcache_interval > 1 runs the full UNet only
+        every that many steps and reuses its deep features in between (faster,
+        slightly different image). token_merging > 0 merges that fraction of
+        similar spatial tokens before each high-resolution self-attention.
+        Classifier-free guidance stops after guidance_cutoff of the steps, or
+        earlier once the conditional and unconditional predictions reach
+        guidance_threshold cosine similarity; later steps cost one UNet
+        evaluation instead of two. When a tiny VAE is loaded it decodes the
+        image unless full_vae is set.
+        """
+        return GenerationRequest(
+            prompt,
+            negative_prompt,
+            seed,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            width=width,
+            height=height,
+            loras=loras,
+            queued_at=queued_at,
+            deepcache_interval=deepcache_interval,
+            token_merging=token_merging,
+            guidance_cutoff=guidance_cutoff,
+            guidance_threshold=guidance_threshold,
+            full_vae=full_vae,
+        )
+
+    def variation_request(
+        self,
+        image,
+        prompt,
+        strength=VARIATION_STRENGTH,
+        negative_prompt=None,
+        seed=None,
+        num_inference_steps=NUM_INFERENCE_STEPS,
+        guidance_scale=GUIDANCE_SCALE,
+        loras=None,
+        queued_at=None,
+        deepcache_interval=1,
+        token_merging=0.0,
+        guidance_cutoff=1.0,
+        guidance_threshold=None,
+        full_vae=False,
+    ):
+        """Describe a variation of an existing character (img2img)
+
+        Starts from image's final latents when this generator produced it
+        (no VAE encode needed), otherwise from the VAE-encoded image. Only
+        about strength * num_inference_steps denoising steps are run.
+        """
+        if int(num_inference_steps * strength) < 1 or strength > 1:
+            raise ValueError(f"strength {strength} runs no denoising steps; use a value in (0, 1]")
+
+        source_key = image.info.get("cache_key")
+        init = self.latent_cache.get(source_key) if source_key else None
+        if init is None:
+            init = image.convert("RGB")
+        if not source_key:
+            source_key = hashlib.sha256(image.tobytes()).hexdigest()
+        return GenerationRequest(
+            prompt,
+            negative_prompt,
+            seed,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            width=image.width,
+            height=image.height,
+            loras=loras,
+            queued_at=queued_at,
+            deepcache_interval=deepcache_interval,
+            token_merging=token_merging,
+            guidance_cutoff=guidance_cutoff,
+            guidance_threshold=guidance_threshold,
+            full_vae=full_vae,
+            init=init,
+            init_key=source_key,
+            strength=strength,
+        )
+
+    def guide_image(self, traits=None, width=IMAGE_SIZE, height=IMAGE_SIZE, rng=random):
+        """Render a procedural avatar scaled to width x height; returns (image, traits)
+
+        traits fixes any of fantasy_avatar_generator's traits (e.g.
+        {"hat": "helmet"}); the rest are drawn from rng.
+        """
+        if self.layouts is None:
+            self.layouts = fantasy_avatar_generator.AvatarGenerator()
+        traits = self.layouts.random_traits(rng, **(traits or {}))
+        surface = pygame.Surface((fantasy_avatar_generator.SCREEN_WIDTH, fantasy_avatar_generator.SCREEN_HEIGHT))
+        self.layouts.render(surface, traits)
+        image = Image.frombytes("RGB", surface.get_size(), pygame.image.tobytes(surface, "RGB"))
+        # Nearest neighbour keeps the hard pixel edges the style is after
+        return image.resize((width, height), Image.NEAREST), traits
+
+    def guided_request(
+        self, prompt, traits=None, strength=GUIDE_STRENGTH, width=IMAGE_SIZE, height=IMAGE_SIZE, seed=None, **kwargs
+    ):
+        """Describe an img2img pass over a procedural avatar (see guide_image)
+
+        The procedural layout supplies the framing and pose, so only about
+        strength * num_inference_steps steps are run. The seed also picks the
+        unspecified traits, so a seed still gives one image. Other keyword
+        arguments are those of variation_request.
+        """
+        if seed is None:
+            seed = random.randrange(2**32)
+        image, _ = self.guide_image(traits, width, height, random.Random(seed))
+        return self.variation_request(image, prompt, strength, seed=seed, **kwargs)
+
+    def generate_avatar(self, prompt, *args, **kwargs):
+        """Generate pixel-art fantasy character from text prompt (see avatar_request)"""
+        return self.run_request(self.avatar_request(prompt, *args, **kwargs))
+
+    def generate_variation(self, image, prompt, *args, **kwargs):
+        """Generate a variation of an existing character (see variation_request)"""
+        return self.run_request(self.variation_request(image, prompt, *args, **kwargs))
+
+    def generate_guided(self, prompt, *args, **kwargs):
+        """Generate a character on top of a procedural avatar (see guided_request)"""
+        return self.run_request(self.guided_request(prompt, *args, **kwargs))
+
+    def default_loras(self):
+        """Resolved default style, or no LoRA when its file is missing"""
+        if DEFAULT_STYLE in self.loras.available():
+            return self.loras.resolve(DEFAULT_STYLE)
+        return ()
+
+    def run_request(self, request):
+        """Run every stage of a request in turn; returns the image or None on failure"""
         if not self.model_loaded:
             print("❌ Model not loaded yet!")
             return None
@@ -124,55 +446,347 @@ class AIAvatarGenerator:
         self.is_generating = True
         self.progress = 0
         self.progress_text = "Starting generation..."
-
-        # Default negative prompt for better quality
-        if negative_prompt is None:
-            negative_prompt = (
-                "blurry, low quality, realistic photo, 3d render, photorealistic, deformed, disfigured, duplicate, watermark, text, signature, busy background, detailed scene, complex scenery"
-            )
-
-        # Enhance prompt for pixel art fantasy character style
-        enhanced_prompt = (
-            f"pixel art, {prompt}, fantasy character, full body, centered, standing on a small display stand base under the feet, flat pixel-art platform with subtle shadow, neutral plain background, vibrant palette, clean outlines, front view, game sprite, 16-bit style"
-        )
-
-        print(f"🎨 Generating: {enhanced_prompt}")
-
         try:
-            # Progress callback function
-            def progress_callback(step, timestep, latents):
-                self.progress = int((step / 30) * 100)  # 30 steps total
-                self.progress_text = f"Step {step}/30 ({self.progress}%)"
-                print(f"   Progress: {self.progress_text}")
-
-            # Generate image with progress tracking
-            image = self.pipeline(
-                prompt=enhanced_prompt,
-                negative_prompt=negative_prompt,
-                num_inference_steps=30,
-                guidance_scale=7.5,
-                width=1024,
-                height=1024,
-                callback=progress_callback,
-                callback_steps=1,
-            ).images[0]
-            # The stand look is driven by the prompt only
-
+            self.prepare(request)
+            if request.image is None:
+                self.denoise(request)
+                self.decode(request)
+                print("✅ Character generated successfully!")
             self.progress = 100
             self.progress_text = "Complete!"
-            print("✅ Character generated successfully!")
-            return image
+            return request.image
 
         except Exception as e:
+            request.job.fields["error"] = str(e)
             print(f"❌ Error generating character: {e}")
             import traceback
             traceback.print_exc()
             return None
         finally:
+            self.finish(request)
             self.is_generating = False
             self.progress = 0
             self.progress_text = ""
 
+    def prepare(self, request):
+        """Stage 1: resolve defaults and the cache key; serves cache hits directly"""
+        request.job = job = self.metrics.start_job(request.queued_at)
+        if self.device == "cuda":
+            torch.cuda.reset_peak_memory_stats()
+
+        # Default negative prompt for better quality
+        if request.negative_prompt is None:
+            request.negative_prompt = (
+                "blurry, low quality, realistic photo, 3d render, photorealistic, deformed, disfigured, duplicate, watermark, text, signature, busy background, detailed scene, complex scenery"
+            )
+
+        if request.seed is None:
+            request.seed = random.randrange(2**32)
+        self.last_seed = request.seed
+
+        # Enhance prompt for pixel art fantasy character style
+        request.enhanced_prompt = (
+            f"pixel art, {request.prompt}, fantasy character, full body, centered, standing on a small display stand base under the feet, flat pixel-art platform with subtle shadow, neutral plain background, vibrant palette, clean outlines, front view, game sprite, 16-bit style"
+        )
+
+        print(f"🎨 Generating: {request.enhanced_prompt}")
+        print(f"🎲 Seed: {request.seed}")
+
+        # img2img only runs the tail of the schedule
+        if request.init is None:
+            request.steps_to_run = request.num_inference_steps
+        else:
+            request.steps_to_run = min(
+                int(request.num_inference_steps * request.strength), request.num_inference_steps
+            )
+            print(
+                f"🔁 Variation: strength {request.strength} "
+                f"({request.steps_to_run}/{request.num_inference_steps} steps)"
+            )
+        request.tiny_decode = self.tiny_vae is not None and not request.full_vae
+        job.fields.update(
+            cached=False,
+            decoder="tiny" if request.tiny_decode else "full",
+            seed=request.seed,
+            steps=request.steps_to_run,
+            width=request.width,
+            height=request.height,
+            device=self.device,
+        )
+
+        request.resolved_loras = (
+            self.default_loras() if request.loras is None else self.loras.resolve(request.loras)
+        )
+        request.cache_params = {
+            "model_id": self.model_id,
+            # Precision and device kernels change the pixels slightly, profile or not
+            "dtype": str(self.pipeline.dtype),
+            "device": self.device,
+            "loras": self.loras.describe(request.resolved_loras),
+            "prompt": request.enhanced_prompt,
+            "negative_prompt": request.negative_prompt,
+            "steps": request.num_inference_steps,
+            "guidance_scale": request.guidance_scale,
+            "width": request.width,
+            "height": request.height,
+            "seed": request.seed,
+            "scheduler": {
+                "name": type(self.pipeline.scheduler).__name__,
+                "config": dict(self.pipeline.scheduler.config),
+            },
+        }
+        if request.init is not None:
+            request.cache_params["init"] = request.init_key
+            request.cache_params["strength"] = request.strength
+        if request.deepcache_interval > 1:
+            request.cache_params["deepcache_interval"] = request.deepcache_interval
+        if request.token_merging > 0:
+            request.cache_params["token_merging"] = request.token_merging
+        if request.guidance_cutoff < 1 or request.guidance_threshold is not None:
+            request.cache_params["guidance_schedule"] = {
+                "cutoff": request.guidance_cutoff,
+                "threshold": request.guidance_threshold,
+            }
+        if request.tiny_decode:
+            request.cache_params["decoder"] = "tiny"
+        if self.profile_config:
+            # dtype and attention kernels change the pixels slightly
+            request.cache_params["profile"] = self.profile_config
+        request.cache_key = make_cache_key(**request.cache_params)
+        if self.cache:
+            with self.metrics.stage("cache_lookup", job):
+                image = self.cache.get(request.cache_key)
+            if image is not None:
+                job.fields["cached"] = True
+                image.info["cache_key"] = request.cache_key
+                request.image = image
+                print("⚡ Returned cached character")
+
+    def denoise(self, request):
+        """Stage 2: swap LoRAs, encode the prompt and denoise to latents"""
+        job = request.job
+
+        # Swap LoRA styles in place; the base model stays resident
+        with self.metrics.stage("lora_swap", job):
+            self.loras.activate(self.pipeline, request.resolved_loras)
+
+        with self.metrics.stage("text_encode", job), torch.no_grad():
+            (
+                prompt_embeds,
+                negative_prompt_embeds,
+                pooled_prompt_embeds,
+                negative_pooled_prompt_embeds,
+            ) = self.pipeline.encode_prompt(
+                prompt=request.enhanced_prompt,
+                device=self.device,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=request.guidance_scale > 1.0,
+                negative_prompt=request.negative_prompt,
+            )
+
+        steps_to_run = request.steps_to_run
+
+        # Progress callback function
+        def progress_callback(pipe, step, timestep, callback_kwargs):
+            if adaptive_guidance:
+                callback_kwargs = guidance.step_end(pipe, step, callback_kwargs)
+            job.mark_step()
+            done = step + 1
+            self.progress = int((done / steps_to_run) * 100)
+            self.progress_text = f"Step {done}/{steps_to_run} ({self.progress}%)"
+            if done % PROGRESS_LOG_INTERVAL == 0 or done == steps_to_run:
+                logger.info("   Progress: %s", self.progress_text)
+            else:
+                logger.debug("   Progress: %s", self.progress_text)
+            return callback_kwargs
+
+        # Seeded on the CPU so results match across devices
+        generator = torch.Generator(device="cpu").manual_seed(request.seed)
+
+        pipeline_kwargs = dict(
+            prompt_embeds=prompt_embeds,
+            negative_prompt_embeds=negative_prompt_embeds,
+            pooled_prompt_embeds=pooled_prompt_embeds,
+            negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
+            num_inference_steps=request.num_inference_steps,
+            guidance_scale=request.guidance_scale,
+            generator=generator,
+            output_type="latent",
+            callback_on_step_end=progress_callback,
+        )
+        if request.init is None:
+            pipeline = self.pipeline
+            latent_shape = (
+                1,
+                pipeline.unet.config.in_channels,
+                request.height // pipeline.vae_scale_factor,
+                request.width // pipeline.vae_scale_factor,
+            )
+            pipeline_kwargs.update(
+                width=request.width,
+                height=request.height,
+                latents=self.memory.noise(latent_shape, prompt_embeds.dtype, generator),
+            )
+        else:
+            pipeline = self.img2img_pipeline
+            init = request.init
+            if not torch.is_tensor(init):
+                # Encode up front so the VAE lock is not held while denoising
+                with self.metrics.stage("vae_encode", job), self.vae_lock:
+                    init = self.encode_image(init, prompt_embeds.dtype, generator)
+            pipeline_kwargs.update(image=init, strength=request.strength)
+
+        # Optionally reuse deep UNet features between full steps
+        if request.deepcache_interval > 1:
+            feature_cache = DeepCache(pipeline.unet, request.deepcache_interval)
+        else:
+            feature_cache = nullcontext()
+        # Optionally merge redundant tokens around self-attention
+        if request.token_merging > 0:
+            token_merging = TokenMerging(pipeline.unet, request.token_merging)
+        else:
+            token_merging = nullcontext()
+        # Optionally stop classifier-free guidance part-way through the schedule
+        adaptive_guidance = request.guidance_scale > 1.0 and (
+            request.guidance_cutoff < 1 or request.guidance_threshold is not None
+        )
+        if adaptive_guidance:
+            guidance = AdaptiveGuidance(pipeline.unet, request.guidance_cutoff, request.guidance_threshold)
+            pipeline_kwargs["callback_on_step_end_tensor_inputs"] = GUIDANCE_TENSORS
+        else:
+            guidance = nullcontext()
+
+        # Denoise to latents; decoding is a separate stage
+        with self.metrics.stage("denoise", job), feature_cache, token_merging, guidance:
+            job.start_steps()
+            request.latents = pipeline(**pipeline_kwargs).images
+        if request.deepcache_interval > 1:
+            job.fields["deepcache"] = {
+                "interval": request.deepcache_interval,
+                "full_steps": feature_cache.full_steps,
+                "cached_steps": feature_cache.cached_steps,
+            }
+        if request.token_merging > 0:
+            job.fields["token_merging"] = {
+                "ratio": request.token_merging,
+                "tokens_in": token_merging.tokens_in,
+                "tokens_out": token_merging.tokens_out,
+            }
+        if adaptive_guidance:
+            job.fields["guidance"] = {
+                "cutoff": request.guidance_cutoff,
+                "threshold": request.guidance_threshold,
+                "guided_steps": guidance.guided_steps,
+                "unet_evaluations": guidance.unet_evaluations,
+                "saved_evaluations": guidance.saved_evaluations,
+            }
+            print(
+                f"🧭 Guidance on {guidance.guided_steps}/{steps_to_run} steps: "
+                f"{guidance.saved_evaluations} UNet evaluations saved"
+            )
+
+    def decode(self, request):
+        """Stage 3: decode the latents to a PIL image and store the result"""
+        job = request.job
+        # The tiny decoder is only used here, so it needs no lock
+        vae_lock = nullcontext() if request.tiny_decode else self.vae_lock
+        with self.metrics.stage("vae_decode", job), vae_lock:
+            decoded = self.decode_latents(request.latents, tiny=request.tiny_decode)
+        with self.metrics.stage("pil_convert", job):
+            image = self.pipeline.image_processor.postprocess(decoded, output_type="pil")[0]
+        # The stand look is driven by the prompt only
+
+        # Remember the latents so a variation of this image can start from them
+        image.info["cache_key"] = request.cache_key
+        self.latent_cache[request.cache_key] = request.latents
+        while len(self.latent_cache) > LATENT_CACHE_SIZE:
+            self.latent_cache.popitem(last=False)
+
+        if self.cache:
+            try:
+                with self.metrics.stage("save", job):
+                    self.cache.put(request.cache_key, image, request.cache_params)
+            except OSError as e:
+                print(f"⚠️  Could not cache result: {e}")
+        request.image = image
+
+    def finish(self, request):
+        """Release the request's tensors and record its metrics (success unless a stage set an error)"""
+        self.memory.release(request)
+        self.metrics.finish_job(
+            request.job,
+            success="error" not in request.job.fields,
+            peak_vram_bytes=torch.cuda.max_memory_allocated() if self.device == "cuda" else None,
+            memory=self.memory.watermarks(),
+        )
+
+    def encode_image(self, image, dtype, generator):
+        """Encode a PIL image to the scaled latents the img2img pipeline starts from
+
+        Mirrors the encode in StableDiffusionXLImg2ImgPipeline.prepare_latents,
+        including the float32 upcast and the draw from generator, so passing
+        the result as image= gives the same output as passing the image.
+        """
+        vae = self.pipeline.vae
+        pixels = self.img2img_pipeline.image_processor.preprocess(image).to(device=vae.device, dtype=dtype)
+        original_dtype = vae.dtype
+        if vae.config.force_upcast:
+            pixels = pixels.float()
+            vae.to(dtype=torch.float32)
+
+        with torch.no_grad():
+            latents = retrieve_latents(vae.encode(pixels), generator=generator)
+
+        if vae.dtype != original_dtype:
+            vae.to(dtype=original_dtype)
+
+        latents = latents.to(dtype)
+        latents_mean = getattr(vae.config, "latents_mean", None)
+        latents_std = getattr(vae.config, "latents_std", None)
+        if latents_mean is not None and latents_std is not None:
+            latents_mean = torch.tensor(latents_mean).view(1, 4, 1, 1).to(latents.device, dtype)
+            latents_std = torch.tensor(latents_std).view(1, 4, 1, 1).to(latents.device, dtype)
+            return (latents - latents_mean) * vae.config.scaling_factor / latents_std
+        return latents * vae.config.scaling_factor
+
+    def decode_latents(self, latents, tiny=False):
+        """Decode SDXL latents to an image tensor with the pipeline's VAE (or the tiny one)
+
+        Mirrors the decode at the end of StableDiffusionXLPipeline.__call__,
+        including the float32 upcast the SDXL VAE needs under float16.
+        """
+        if tiny:
+            # The tiny autoencoder works on the scaled latents directly and is fine in float16
+            vae = self.tiny_vae
+            with torch.no_grad():
+                image = vae.decode(latents.to(device=vae.device, dtype=vae.dtype), return_dict=False)[0]
+        else:
+            vae = self.pipeline.vae
+            needs_upcasting = vae.dtype == torch.float16 and vae.config.force_upcast
+            if needs_upcasting:
+                vae.to(dtype=torch.float32)
+            latents = latents.to(device=vae.device, dtype=vae.dtype)
+
+            latents_mean = getattr(vae.config, "latents_mean", None)
+            latents_std = getattr(vae.config, "latents_std", None)
+            if latents_mean is not None and latents_std is not None:
+                latents_mean = torch.tensor(latents_mean).view(1, 4, 1, 1).to(latents.device, latents.dtype)
+                latents_std = torch.tensor(latents_std).view(1, 4, 1, 1).to(latents.device, latents.dtype)
+                latents = latents * latents_std / vae.config.scaling_factor + latents_mean
+            else:
+                latents = latents / vae.config.scaling_factor
+
+            with torch.no_grad():
+                image = vae.decode(latents, return_dict=False)[0]
+
+            if needs_upcasting:
+                vae.to(dtype=torch.float16)
+
+        watermark = getattr(self.pipeline, "watermark", None)
+        if watermark is not None:
+            image = watermark.apply_watermark(image)
+        return image
+
     # Stand aesthetics are prompt-driven; no image compositing
 
 
@@ -197,10 +811,12 @@ class TextInputBox:
                 return "submit"
             elif event.key == pygame.K_BACKSPACE:
                 self.text = self.text[:-1]
+                return "edit"
             else:
                 # Add character if it's printable
                 if event.unicode.isprintable():
                     self.text += event.unicode
+                    return "edit"
 
         return None
 
@@ -272,6 +888,75 @@ class Button:
         surface.blit(text_surface, text_rect)
 
 
+class HistoryGallery:
+    """Scrollable column of history thumbnails; only the visible ones are loaded"""
+
+    def __init__(self, x, y, height, history, font):
+        self.rows = max(1, (height - GALLERY_PADDING) // (THUMB_SIZE + GALLERY_PADDING))
+        self.rect = pygame.Rect(
+            x, y, THUMB_SIZE + 2 * GALLERY_PADDING, self.rows * (THUMB_SIZE + GALLERY_PADDING) + GALLERY_PADDING
+        )
+        self.history = history
+        self.font = font
+        self.offset = 0
+        self.total = 0
+        self.entries = []
+        self.thumbnails = OrderedDict()  # entry id -> surface, least recently drawn first
+        self.refresh()
+
+    def refresh(self):
+        """Re-read the visible page of the index (after a new entry or a scroll)"""
+        self.total = self.history.count()
+        self.offset = max(0, min(self.offset, self.total - self.rows))
+        self.entries = self.history.page(self.offset, self.rows)
+
+    def handle_event(self, event):
+        """Scroll with the mouse wheel; returns the clicked entry, if any"""
+        if event.type == pygame.MOUSEWHEEL and self.rect.collidepoint(pygame.mouse.get_pos()):
+            self.offset -= event.y
+            self.refresh()
+        elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and self.rect.collidepoint(event.pos):
+            row = (event.pos[1] - self.rect.y - GALLERY_PADDING) // (THUMB_SIZE + GALLERY_PADDING)
+            if 0 <= row < len(self.entries):
+                return self.entries[row]
+        return None
+
+    def thumbnail(self, entry):
+        """Decoded thumbnail surface; loaded from disk on first use, LRU-bounded"""
+        surface = self.thumbnails.get(entry.id)
+        if surface is None:
+            surface = pygame.image.load(str(self.history.thumbnail_path(entry))).convert()
+            self.thumbnails[entry.id] = surface
+            while len(self.thumbnails) > GALLERY_CACHE_SIZE:
+                self.thumbnails.popitem(last=False)
+        else:
+            self.thumbnails.move_to_end(entry.id)
+        return surface
+
+    def draw(self, surface, selected_id=None):
+        """Draw the visible thumbnails, highlighting the one on screen"""
+        pygame.draw.rect(surface, LIGHT_GRAY, self.rect)
+        for row, entry in enumerate(self.entries):
+            position = (
+                self.rect.x + GALLERY_PADDING,
+                self.rect.y + GALLERY_PADDING + row * (THUMB_SIZE + GALLERY_PADDING),
+            )
+            try:
+                surface.blit(self.thumbnail(entry), position)
+            except (pygame.error, FileNotFoundError):
+                continue  # thumbnail deleted by hand
+            if entry.id == selected_id:
+                pygame.draw.rect(surface, BLUE, (position, (THUMB_SIZE, THUMB_SIZE)), 3)
+
+        if self.total > self.rows:
+            label = f"{self.offset + 1}-{self.offset + len(self.entries)}/{self.total}"
+        else:
+            label = "History" if self.total else "No history"
+        text = self.font.render(label, True, DARK_GRAY)
+        surface.blit(text, text.get_rect(midtop=(self.rect.centerx, self.rect.bottom + 4)))
+        pygame.draw.rect(surface, GRAY, self.rect, 2)
+
+
 def pil_to_pygame(pil_image):
     """Convert PIL Image to Pygame Surface"""
     import io
@@ -303,8 +988,160 @@ def save_avatar(pil_image):
     return filename
 
 
-def main():
+def merge_ratio(text):
+    """argparse type for --tome: a fraction of tokens in [0, 1)"""
+    ratio = float(text)
+    if not 0 <= ratio < 1:
+        raise argparse.ArgumentTypeError(f"merge ratio must be in [0, 1), got {text}")
+    return ratio
+
+
+def guidance_cutoff(text):
+    """argparse type for --cfg-cutoff: a fraction of the steps in (0, 1]"""
+    cutoff = float(text)
+    if not 0 < cutoff <= 1:
+        raise argparse.ArgumentTypeError(f"guidance cutoff must be in (0, 1], got {text}")
+    return cutoff
+
+
+def guidance_threshold(text):
+    """argparse type for --cfg-threshold: a cosine similarity in [-1, 1]"""
+    threshold = float(text)
+    if not -1 <= threshold <= 1:
+        raise argparse.ArgumentTypeError(f"guidance threshold must be in [-1, 1], got {text}")
+    return threshold
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Pixel Art Fantasy Character Generator")
+    parser.add_argument(
+        "--preload",
+        choices=PRELOAD_POLICIES,
+        default=PRELOAD_POLICY,
+        help=f"When to start loading the model (default: {PRELOAD_POLICY})",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Use a resident model daemon that keeps the pipeline loaded across restarts",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=("DEBUG", "INFO", "WARNING", "ERROR"),
+        default="INFO",
+        help="Logging level; DEBUG logs every denoising step",
+    )
+    parser.add_argument("--metrics-log", help="Append per-generation metrics as JSON lines to this file")
+    parser.add_argument(
+        "--metrics-port", type=int, help="Serve Prometheus-style metrics on this local port"
+    )
+    parser.add_argument(
+        "--deepcache",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Run the full UNet every N steps and reuse deep features in between (default: 1, off)",
+    )
+    parser.add_argument(
+        "--tome",
+        type=merge_ratio,
+        default=0.0,
+        metavar="RATIO",
+        help="Merge this fraction of similar tokens before self-attention (default: 0, off)",
+    )
+    parser.add_argument(
+        "--cfg-cutoff",
+        type=guidance_cutoff,
+        default=1.0,
+        metavar="FRACTION",
+        help="Stop classifier-free guidance after this fraction of the steps (default: 1, never)",
+    )
+    parser.add_argument(
+        "--cfg-threshold",
+        type=guidance_threshold,
+        metavar="SIMILARITY",
+        help=f"Also stop guidance once both predictions reach this cosine similarity (e.g. {GUIDANCE_THRESHOLD})",
+    )
+    parser.add_argument(
+        "--tiny-vae",
+        type=Path,
+        metavar="PATH",
+        help=f"Decode final images with a tiny autoencoder from this local file or directory (e.g. {TINY_VAE_PATH})",
+    )
+    parser.add_argument("--no-history", action="store_true", help="Do not record generations in the history gallery")
+    parser.add_argument(
+        "--guided",
+        action="store_true",
+        help=f"Start each character from a procedural avatar (img2img at strength {GUIDE_STRENGTH})",
+    )
+
+    commands = parser.add_subparsers(dest="command")
+    batch = commands.add_parser("batch", help="Generate every prompt in a JSONL file without the UI")
+    batch.add_argument("prompts", type=Path, help="JSONL file with one {\"prompt\": ...} object per line")
+    batch.add_argument("--out", type=Path, help="Output directory (default: output/batch_<file name>)")
+    batch.add_argument("--model", default=MODEL_ID, help="Base model id or local directory")
+    batch.add_argument("--steps", type=int, default=NUM_INFERENCE_STEPS, help="Denoising steps per image")
+    batch.add_argument("--guidance", type=float, default=GUIDANCE_SCALE, help="Classifier-free guidance scale")
+    batch.add_argument("--size", type=int, default=IMAGE_SIZE, help="Image width and height")
+    batch.add_argument("--no-cache", action="store_true", help="Do not read or write the generation cache")
+    batch.add_argument(
+        "--pipeline",
+        action=argparse.BooleanOptionalAction,
+        help="Decode each image while the next one denoises (default: on CUDA only)",
+    )
+    return parser.parse_args(argv)
+
+
+def request_options(args):
+    """Per-request generation options selected on the command line"""
+    options = {}
+    if args.deepcache > 1:
+        options["deepcache_interval"] = args.deepcache
+    if args.tome > 0:
+        options["token_merging"] = args.tome
+    if args.cfg_cutoff < 1:
+        options["guidance_cutoff"] = args.cfg_cutoff
+    if args.cfg_threshold is not None:
+        options["guidance_threshold"] = args.cfg_threshold
+    return options
+
+
+def run_batch_command(args):
+    """Headless batch mode: stream a JSONL prompt file through one generator"""
+    from batch_runner import run_batch
+
+    generator = AIAvatarGenerator(
+        model_id=args.model,
+        cache=False if args.no_cache else None,
+        metrics=GenerationMetrics(args.metrics_log),
+        tiny_vae=args.tiny_vae,
+    )
+    if args.metrics_port:
+        generator.metrics.serve_prometheus(args.metrics_port)
+    out_dir = args.out or Path("output") / f"batch_{args.prompts.stem}"
+    _, _, failed = run_batch(
+        generator,
+        args.prompts,
+        out_dir,
+        pipelined=args.pipeline,
+        num_inference_steps=args.steps,
+        guidance_scale=args.guidance,
+        width=args.size,
+        height=args.size,
+        guided=args.guided,
+        **request_options(args),
+    )
+    return 1 if failed else 0
+
+
+def main(argv=None):
     """Main application loop"""
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="%(message)s")
+    if args.command == "batch":
+        return run_batch_command(args)
+
     pygame.init()
     pygame.font.init()
 
@@ -328,21 +1165,53 @@ def main():
     )
     generate_button = Button(SCREEN_WIDTH - 190, SCREEN_HEIGHT - 130, 140, 40, "Generate", font)
     save_button = Button(SCREEN_WIDTH - 190, SCREEN_HEIGHT - 80, 140, 40, "Save", font, color=GREEN)
+    vary_button = Button(SCREEN_WIDTH - 340, SCREEN_HEIGHT - 80, 140, 40, "Vary", font)
     quit_button = Button(
         SCREEN_WIDTH - 190, SCREEN_HEIGHT - 30, 140, 40, "Quit", font, color=(200, 50, 50)
     )
 
-    # Create generator
-    generator = AIAvatarGenerator()
+    # Create generator (the daemon client mirrors the AIAvatarGenerator interface)
+    if args.daemon:
+        from model_daemon import DaemonClient
+
+        # Generation metrics and decoding live in the daemon, so it gets those options
+        generator = DaemonClient(
+            daemon_options=dict(
+                metrics_log=args.metrics_log, metrics_port=args.metrics_port, tiny_vae=args.tiny_vae
+            )
+        )
+    else:
+        generator = AIAvatarGenerator(metrics=GenerationMetrics(args.metrics_log), tiny_vae=args.tiny_vae)
+        if args.metrics_port:
+            generator.metrics.serve_prometheus(args.metrics_port)
+    options = request_options(args)
+
+    # Every generated character is kept in the history gallery on the left
+    history = None if args.no_history else GenerationHistory()
+    gallery = None
+    if history is not None:
+        gallery = HistoryGallery(
+            (SCREEN_WIDTH - AVATAR_SIZE) // 2 - THUMB_SIZE - 2 * GALLERY_PADDING - 24,
+            AVATAR_Y_OFFSET,
+            AVATAR_SIZE,
+            history,
+            small_font,
+        )
+    history_changed = False
 
     # Current character image
     current_avatar_pil = None
     current_avatar_surface = None
+    current_entry_id = None
 
     # Loading / generation state
     loading_model = False
     generating = False
     pending_prompt = None
+    pending_queued_at = None
+    load_thread = None
+    preload_started = False
+    last_input_ticks = None  # the idle timer starts at the first keystroke
 
     # Clock
     clock = pygame.time.Clock()
@@ -356,12 +1225,99 @@ def main():
     print("4. Press ESC to quit")
     print("=" * 50)
 
+    def start_model_load():
+        """Kick off the model load in the background (no-op if already started)"""
+        nonlocal loading_model, load_thread
+        if loading_model or generator.model_loaded:
+            return
+        loading_model = True
+        load_thread = threading.Thread(target=generator.load_model, daemon=True)
+        load_thread.start()
+
+    def preload_model():
+        """Speculative load; only attempted once so a failed load is not retried in a loop"""
+        nonlocal preload_started
+        if not preload_started:
+            preload_started = True
+            start_model_load()
+
+    def start_generation(prompt, queued_at=None, source=None):
+        """Generate in a background thread; the last image stays visible under an overlay
+
+        With source set, a variation of that image is generated instead.
+        """
+        nonlocal generating
+        if queued_at is None:
+            queued_at = time.perf_counter()
+
+        # Picked here so the history records it even when generating on the daemon
+        seed = random.randrange(2**32)
+
+        def generate_thread():
+            nonlocal current_avatar_pil, generating, current_avatar_surface, current_entry_id, history_changed
+            print("🚀 Starting generation thread...")
+            started = time.perf_counter()
+            if source is not None:
+                img = generator.generate_variation(source, prompt, seed=seed, queued_at=queued_at, **options)
+            elif args.guided:
+                img = generator.generate_guided(prompt, seed=seed, queued_at=queued_at, **options)
+            else:
+                img = generator.generate_avatar(prompt, seed=seed, queued_at=queued_at, **options)
+            if img is not None:
+                entry_id = None
+                if history is not None:
+                    record = generator.metrics.last_record
+                    timings = {"wall_s": round(time.perf_counter() - started, 3)}
+                    if record and record.get("seed") == seed:
+                        timings.update(total_s=record["total_s"], stages_s=record["stages_s"])
+                    try:
+                        entry_id = history.add(
+                            img,
+                            prompt,
+                            seed=seed,
+                            kind="variation" if source is not None else "guided" if args.guided else "avatar",
+                            parameters=dict(options, source=source.info.get("cache_key") if source is not None else None),
+                            timings=timings,
+                        )
+                        history_changed = True
+                    except (OSError, sqlite3.Error) as e:
+                        print(f"⚠️  Could not record history: {e}")
+                current_avatar_pil = img
+                current_entry_id = entry_id
+                current_avatar_surface = None  # Force re-conversion on main thread
+                print("✅ Generation complete! Image ready.")
+            else:
+                print("❌ Generation failed - no image returned")
+            generating = False
+
+        generating = True
+        threading.Thread(target=generate_thread, daemon=True).start()
+
+    def request_generation(prompt):
+        """Generate now, or queue the prompt until the model has loaded"""
+        nonlocal pending_prompt, pending_queued_at
+        if not generator.model_loaded:
+            if prompt.strip():
+                pending_prompt = prompt
+                pending_queued_at = time.perf_counter()
+            start_model_load()
+        elif prompt.strip():
+            start_generation(prompt)
+
+    if args.preload == "eager":
+        preload_model()
+
     running = True
 
     while running:
         dt = clock.tick(60)
 
         for event in pygame.event.get():
+            if event.type == pygame.KEYDOWN or (
+                event.type == pygame.MOUSEBUTTONDOWN and last_input_ticks is not None
+            ):
+                last_input_ticks = pygame.time.get_ticks()
+
             if event.type == pygame.QUIT:
                 running = False
 
@@ -375,29 +1331,12 @@ def main():
 
             # Handle input box
             result = input_box.handle_event(event)
-            if result == "submit" and not generating and not loading_model:
+            if result == "edit" and args.preload == "keystroke":
+                preload_model()
+            # A prompt submitted while the model is still preloading is queued
+            if result == "submit" and not generating:
                 # Generate on Enter key
-                prompt = input_box.text
-                if not generator.model_loaded:
-                    if prompt.strip():
-                        pending_prompt = prompt
-                    loading_model = True
-                    threading.Thread(target=generator.load_model, daemon=True).start()
-                else:
-                    if prompt.strip():
-                        generating = True
-                        # Keep the last image visible; we'll gray it out with an overlay
-                        # Generate in background thread
-                        def generate_thread():
-                            nonlocal current_avatar_pil, generating, current_avatar_surface
-                            img = generator.generate_avatar(prompt)
-                            if img is not None:
-                                current_avatar_pil = img
-                                # Invalidate surface to force re-conversion next frame
-                                current_avatar_surface = None
-                            generating = False
-
-                        threading.Thread(target=generate_thread, daemon=True).start()
+                request_generation(input_box.text)
 
             # Handle generate button
             button_clicked = generate_button.handle_event(event)
@@ -406,38 +1345,34 @@ def main():
                     f"🔘 Generate button clicked! loading_model={loading_model}, generating={generating}, model_loaded={generator.model_loaded}"
                 )
 
-            if button_clicked and not generating and not loading_model:
+            if button_clicked and not generating:
                 prompt = input_box.text
-                if not generator.model_loaded:
-                    if prompt.strip():
-                        pending_prompt = prompt
-                    loading_model = True
-                    threading.Thread(target=generator.load_model, daemon=True).start()
+                if generator.model_loaded and prompt.strip():
+                    print(f"🎯 Generate button clicked! Prompt: {prompt}")
+                request_generation(prompt)
+
+            # Handle vary button: small tweak of the character on screen
+            if vary_button.handle_event(event) and not generating and generator.model_loaded:
+                if current_avatar_pil is not None and input_box.text.strip():
+                    start_generation(input_box.text, source=current_avatar_pil)
+
+            # Restore a past character from the history gallery
+            entry = gallery.handle_event(event) if gallery is not None else None
+            if entry is not None:
+                try:
+                    current_avatar_pil = history.load_image(entry)
+                except OSError as e:
+                    print(f"❌ Could not load history entry {entry.id}: {e}")
                 else:
-                    if prompt.strip():
-                        print(f"🎯 Generate button clicked! Prompt: {prompt}")
-                        generating = True
-                        # Keep the last image visible; we'll gray it out with an overlay
-
-                        # Generate in background thread
-                        def generate_thread():
-                            nonlocal current_avatar_pil, generating, current_avatar_surface
-                            print("🚀 Starting generation thread...")
-                            img = generator.generate_avatar(prompt)
-                            if img is not None:
-                                current_avatar_pil = img
-                                current_avatar_surface = None  # Force re-conversion on main thread
-                                print("✅ Generation complete! Image ready.")
-                            else:
-                                print("❌ Generation failed - no image returned")
-                            generating = False
-
-                        threading.Thread(target=generate_thread, daemon=True).start()
+                    current_avatar_surface = None
+                    current_entry_id = entry.id
+                    input_box.text = entry.prompt
 
             # Handle save button
             if save_button.handle_event(event):
                 if current_avatar_pil is not None:
-                    save_avatar(current_avatar_pil)
+                    with generator.metrics.stage("save"):
+                        save_avatar(current_avatar_pil)
 
             # Handle quit button
             if quit_button.handle_event(event):
@@ -445,9 +1380,20 @@ def main():
 
         # Update
         input_box.update(dt)
+        if history_changed:
+            history_changed = False
+            gallery.refresh()
+
+        # Speculative preload once the user pauses
+        if (
+            args.preload == "idle"
+            and last_input_ticks is not None
+            and pygame.time.get_ticks() - last_input_ticks >= PRELOAD_IDLE_MS
+        ):
+            preload_model()
 
         # Check if model finished loading
-        if loading_model and not generator.is_loading:
+        if loading_model and not load_thread.is_alive():
             loading_model = False
             if DEBUG:
                 print(f"✅ Model loading flag reset! loading_model={loading_model}")
@@ -456,25 +1402,15 @@ def main():
                 print(f"🚀 Starting queued generation for prompt: {pending_prompt}")
                 prompt = pending_prompt
                 pending_prompt = None
-                generating = True
                 current_avatar_surface = None
-
-                def generate_thread():
-                    nonlocal current_avatar_pil, generating, current_avatar_surface
-                    img = generator.generate_avatar(prompt)
-                    if img is not None:
-                        current_avatar_pil = img
-                        current_avatar_surface = None
-                        print("✅ Generation complete! Image ready.")
-                    else:
-                        print("❌ Generation failed - no image returned")
-                    generating = False
-
-                threading.Thread(target=generate_thread, daemon=True).start()
+                start_generation(prompt, pending_queued_at)
 
         # Update button states
-        generate_button.enabled = not generating and not loading_model
+        generate_button.enabled = not generating
         save_button.enabled = current_avatar_pil is not None
+        vary_button.enabled = (
+            current_avatar_pil is not None and generator.model_loaded and not generating
+        )
 
         # Debug: Check what's happening with image conversion
         if DEBUG and not generating and current_avatar_pil is not None:
@@ -571,6 +1507,9 @@ def main():
                 )
                 screen.blit(step_text, step_rect)
 
+        if gallery is not None:
+            gallery.draw(screen, current_entry_id)
+
         # Draw prompt label
         prompt_label = font.render("Prompt:", True, BLACK)
         screen.blit(prompt_label, (50, SCREEN_HEIGHT - 160))
@@ -579,6 +1518,7 @@ def main():
         input_box.draw(screen)
         generate_button.draw(screen)
         save_button.draw(screen)
+        vary_button.draw(screen)
         quit_button.draw(screen)
 
         # Status text
@@ -595,15 +1535,21 @@ def main():
             screen.blit(status, (50, status_y))
         elif not generator.model_loaded:
             status = small_font.render(
-                "Click Generate to load the AI model", True, DARK_GRAY
+                "Click Generate to load the AI model"
+                if args.preload == "click" or preload_started
+                else "AI model will load in the background",
+                True,
+                DARK_GRAY,
             )
             screen.blit(status, (50, status_y))
 
         # Update display
         pygame.display.flip()
 
+    if history is not None:
+        history.close()
     pygame.quit()
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Hardware Autotuner
+Finds the fastest generator configuration this machine actually supports
+and saves it as a profile that AIAvatarGenerator applies when it loads the
+model. The tuned options are the attention backend (PyTorch SDPA, xformers
+or sliced attention), the PyTorch thread count (CPU), the weight dtype and
+the channels-last memory layout of the UNet.
+
+Options are tuned one at a time (coordinate descent) starting from SDPA with
+the default dtype, each timed with short real generations. An option is only
+adopted if it is measurably faster and produces a usable image, so backends
+that are missing or produce NaNs on this hardware are skipped.
+
+Usage:
+    python autotune.py --size 512 --steps 4
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+# Where the profile is written and looked up
+PROFILE_PATH = Path("cache") / "hardware_profile.json"
+
+# A candidate must beat the current best by this fraction to be adopted
+MIN_GAIN = 0.03
+
+ATTENTION_BACKENDS = ("sdpa", "xformers", "sliced")
+
+DTYPES = {"float32": torch.float32, "float16": torch.float16, "bfloat16": torch.bfloat16}
+
+# Fingerprint fields recorded for reference that do not invalidate a profile
+# (pinned worker_pool processes see fewer CPUs than the tuning run did)
+INFORMATIONAL_FIELDS = ("affinity",)
+
+
+def machine_fingerprint(device):
+    """What a profile was tuned on; a profile only applies to a matching machine
+
+    cpus counts the machine's CPUs; affinity counts the ones this process
+    may run on.
+    """
+    import diffusers
+
+    if device == "cuda":
+        hardware = torch.cuda.get_device_name(0)
+    else:
+        hardware = platform.processor() or platform.machine()
+    cpus = os.cpu_count() or 1
+    affinity = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else cpus
+    return {
+        "device": device,
+        "hardware": hardware,
+        "cpus": cpus,
+        "affinity": affinity,
+        "torch": torch.__version__,
+        "diffusers": diffusers.__version__,
+    }
+
+
+def default_config(device):
+    """The configuration tuning starts from"""
+    return {
+        "attention": "sdpa",
+        "dtype": "float16" if device == "cuda" else "float32",
+        "channels_last": False,
+        "threads": None if device == "cuda" else torch.get_num_threads(),
+    }
+
+
+def candidate_values(device):
+    """Values tried for each option, in tuning order"""
+    candidates = {}
+    if device == "cuda":
+        candidates["attention"] = ATTENTION_BACKENDS
+        candidates["dtype"] = ("float16", "bfloat16") if torch.cuda.is_bf16_supported() else ("float16",)
+    else:
+        # xformers kernels are CUDA only
+        candidates["attention"] = ("sdpa", "sliced")
+        candidates["dtype"] = ("float32", "bfloat16")
+        cpus = machine_fingerprint(device)["affinity"]
+        candidates["threads"] = tuple(sorted({cpus, max(1, cpus // 2), max(1, cpus // 4)}, reverse=True))
+    candidates["channels_last"] = (False, True)
+    return candidates
+
+
+def _identity(fingerprint):
+    """The fingerprint fields a profile must match"""
+    return {key: value for key, value in fingerprint.items() if key not in INFORMATIONAL_FIELDS}
+
+
+def load_profile(device, path=PROFILE_PATH):
+    """The saved profile if it was tuned on this machine, otherwise None"""
+    path = Path(path)
+    try:
+        with open(path, encoding="utf-8") as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if _identity(profile.get("machine", {})) != _identity(machine_fingerprint(device)):
+        print(f"ℹ️  {path} was tuned on different hardware or libraries; rerun autotune.py")
+        return None
+    return profile
+
+
+def profile_dtype(profile):
+    """torch dtype the profile asks the weights to be loaded in"""
+    return DTYPES[profile["config"]["dtype"]]
+
+
+def apply_profile(pipeline, profile, convert_dtype=True, convert_layout=True):
+    """Apply a tuned configuration to a loaded pipeline (and the modules it shares)
+
+    Returns the configuration actually in effect: without convert_dtype the
+    weights keep the dtype they were loaded in, and without convert_layout
+    the UNet keeps its memory layout (re-laying out memory-mapped weights
+    copies them into private memory).
+    """
+    from diffusers.models.attention_processor import AttnProcessor2_0
+
+    config = dict(profile["config"])
+    dtype = DTYPES[config["dtype"]]
+    if convert_dtype and pipeline.unet.dtype != dtype:
+        pipeline.to(dtype=dtype)
+    config["dtype"] = str(pipeline.unet.dtype).removeprefix("torch.")
+
+    # Start from SDPA everywhere so switching backends never stacks them
+    pipeline.unet.set_attn_processor(AttnProcessor2_0())
+    pipeline.vae.set_attn_processor(AttnProcessor2_0())
+    if config["attention"] == "xformers":
+        pipeline.enable_xformers_memory_efficient_attention()
+    elif config["attention"] == "sliced":
+        pipeline.enable_attention_slicing()
+
+    if convert_layout:
+        memory_format = torch.channels_last if config["channels_last"] else torch.contiguous_format
+        pipeline.unet.to(memory_format=memory_format)
+    else:
+        config["channels_last"] = False
+
+    # An explicit OMP_NUM_THREADS (e.g. a pinned worker_pool process) wins
+    if config["threads"] and "OMP_NUM_THREADS" not in os.environ:
+        torch.set_num_threads(config["threads"])
+    return config
+
+
+def _time_config(generator, config, size, steps, repeats):
+    """Median seconds per image under config, or None if it fails or yields a blank image"""
+    try:
+        apply_profile(generator.pipeline, {"config": config})
+    except Exception as e:
+        print(f"   ✗ {e}")
+        return None
+
+    kwargs = dict(num_inference_steps=steps, width=size, height=size, seed=0)
+    # Warm-up: kernel selection, allocator growth, first-call overhead
+    image = generator.generate_avatar("autotune", **kwargs)
+    if image is None:
+        return None
+    if not np.asarray(image).any():
+        print("   ✗ blank image (NaNs in this dtype?)")
+        return None
+
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        if generator.generate_avatar("autotune", **kwargs) is None:
+            return None
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def autotune(generator, size=512, steps=4, repeats=2):
+    """Tune generator's loaded pipeline; returns the profile (config plus every measurement)"""
+    device = generator.device
+    config = default_config(device)
+    if generator.mmap_weights:
+        # Memory-mapped weights are float32 views of the files
+        config["dtype"] = "float32"
+    print(f"⏱️  baseline {config}")
+    best = _time_config(generator, config, size, steps, repeats)
+    if best is None:
+        raise RuntimeError("The default configuration does not run on this machine")
+    trials = [dict(config, seconds=round(best, 4))]
+    print(f"   {best:.3f}s per image")
+
+    for option, values in candidate_values(device).items():
+        if option == "dtype" and generator.mmap_weights:
+            continue
+        for value in values:
+            if value == config[option]:
+                continue
+            trial = dict(config, **{option: value})
+            print(f"⏱️  {option}={value}")
+            seconds = _time_config(generator, trial, size, steps, repeats)
+            trials.append(dict(trial, seconds=None if seconds is None else round(seconds, 4)))
+            if seconds is None:
+                continue
+            print(f"   {seconds:.3f}s per image")
+            if seconds < best * (1 - MIN_GAIN):
+                config, best = trial, seconds
+
+    apply_profile(generator.pipeline, {"config": config})
+    return {
+        "machine": machine_fingerprint(device),
+        "config": config,
+        "seconds_per_image": round(best, 4),
+        "benchmark": {"size": size, "steps": steps, "model_id": generator.model_id},
+        "trials": trials,
+    }
+
+
+def save_profile(profile, path=PROFILE_PATH):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def main():
+    from ai_avatar_generator import MODEL_ID, AIAvatarGenerator
+
+    parser = argparse.ArgumentParser(description="Benchmark generator options and save the fastest as a profile")
+    parser.add_argument("--model", default=MODEL_ID, help="Base model id or local directory")
+    parser.add_argument("--size", type=int, default=512, help="Image width and height used for timing")
+    parser.add_argument("--steps", type=int, default=4, help="Denoising steps per timed image")
+    parser.add_argument("--repeats", type=int, default=2, help="Timed images per configuration")
+    parser.add_argument("--out", type=Path, default=PROFILE_PATH, help=f"Profile path (default: {PROFILE_PATH})")
+    args = parser.parse_args()
+
+    # No cache (repeats would be hits) and no existing profile (tuning starts from defaults)
+    generator = AIAvatarGenerator(model_id=args.model, cache=False, profile=False)
+    generator.load_model()
+    if not generator.model_loaded:
+        return 1
+    profile = autotune(generator, args.size, args.steps, args.repeats)
+    save_profile(profile, args.out)
+
+    baseline = profile["trials"][0]["seconds"]
+    print(f"\n✅ Fastest configuration: {profile['config']}")
+    print(f"   {profile['seconds_per_image']:.3f}s per image ({baseline / profile['seconds_per_image']:.2f}x vs baseline)")
+    print(f"   Saved to {args.out}; AIAvatarGenerator applies it on load")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
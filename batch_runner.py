@@ -0,0 +1,197 @@
+"""
+Resumable Batch Generation
+Streams prompts from a JSONL file through one AIAvatarGenerator, writing each
+image and a line of results.jsonl as soon as it is done. Progress is
+checkpointed after every item, so a killed run picks up where it stopped;
+items whose image already exists are skipped. Up to IN_FLIGHT items are
+generated ahead on CUDA, so decoding one overlaps denoising the next.
+
+Each input line is a JSON object:
+    {"prompt": "an elf archer", "seed": 7, "negative_prompt": "...", "id": "elf-01"}
+Only "prompt" is required. Optional per-item overrides: steps, guidance_scale,
+width, height, loras, full_vae (skip the tiny decoder for this item).
+"guided": true starts the item from a procedural avatar
+(AIAvatarGenerator.generate_guided); "traits" fixes some of its traits, e.g.
+{"hat": "helmet"}, and implies guided.
+"""
+
+import json
+import os
+import random
+import time
+from collections import deque
+from pathlib import Path
+
+from staged_pipeline import StagedGenerator
+
+# Per-item keys passed straight through to generate_avatar
+ITEM_OPTIONS = ("negative_prompt", "seed", "guidance_scale", "width", "height", "loras", "guided", "traits", "full_vae")
+
+# Items submitted ahead of the oldest unfinished one
+IN_FLIGHT = 2
+
+RESULTS_FILE = "results.jsonl"
+CHECKPOINT_FILE = "checkpoint.json"
+
+
+def _write_json_atomic(path, data):
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _recorded_ids(results_path):
+    """Item ids that already have a line in results.jsonl"""
+    if not results_path.exists():
+        return set()
+    ids = set()
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                ids.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                continue  # a line cut short by a kill
+    return ids
+
+
+def _plan_item(line, line_no, out_dir, defaults, recorded):
+    """Parse one input line; returns (outcome, results entry or None, generation or None)
+
+    outcome is None when the item still has to be generated; the generation
+    is then (entry, image_path, prompt, generate_avatar keyword arguments).
+    """
+    item_id = f"{line_no + 1:06d}"
+    try:
+        item = json.loads(line)
+        item_id = str(item.get("id", item_id))
+        prompt = item["prompt"]
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        print(f"❌ Line {line_no + 1}: invalid item ({e})")
+        return "failed", {"id": item_id, "line": line_no + 1, "status": "invalid", "error": str(e)}, None
+
+    image_path = out_dir / f"{item_id}.png"
+    entry = {"id": item_id, "line": line_no + 1, "prompt": prompt}
+    if image_path.exists():
+        if item_id in recorded:
+            return "skipped", None, None
+        return "skipped", dict(entry, status="exists", image=image_path.name), None
+
+    kwargs = dict(defaults)
+    kwargs.update({key: item[key] for key in ITEM_OPTIONS if key in item})
+    if "steps" in item:
+        kwargs["num_inference_steps"] = item["steps"]
+    # Chosen here so the results line can record it while later items run
+    if kwargs.get("seed") is None:
+        kwargs["seed"] = random.randrange(2**32)
+    entry["seed"] = kwargs["seed"]
+    if "traits" in kwargs:
+        kwargs["guided"] = True
+    if kwargs.get("guided"):
+        entry["guided"] = True
+    return None, None, (entry, image_path, prompt, kwargs)
+
+
+def _save_item(image, entry, image_path, started):
+    """Write a finished item's image; returns (outcome, results entry)"""
+    entry["seconds"] = round(time.perf_counter() - started, 3)
+    if image is None:
+        return "failed", dict(entry, status="error")
+
+    # Write under a temporary name so a kill never leaves a partial PNG behind
+    tmp_path = image_path.with_suffix(".tmp")
+    image.save(tmp_path, format="PNG")
+    os.replace(tmp_path, image_path)
+    return "done", dict(entry, status="ok", image=image_path.name)
+
+
+def run_batch(generator, prompts_path, out_dir, pipelined=None, **defaults):
+    """Generate every prompt in prompts_path into out_dir; returns (done, skipped, failed)
+
+    defaults are generate_avatar keyword arguments applied to every item
+    unless the item overrides them. When pipelined (by default on CUDA),
+    items run through a StagedGenerator so one item's VAE decode overlaps
+    the next item's denoising; results and the checkpoint are still written
+    in input order, and only the few images in flight are held in memory.
+    On CPU both stages would compete for the same cores, so items run one
+    at a time unless pipelined=True.
+    """
+    prompts_path = Path(prompts_path)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    results_path = out_dir / RESULTS_FILE
+    checkpoint_path = out_dir / CHECKPOINT_FILE
+    source_id = str(prompts_path.resolve())
+
+    start_line = 0
+    if checkpoint_path.exists():
+        with open(checkpoint_path, encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("source") == source_id:
+            start_line = checkpoint["next_line"]
+            print(f"⏩ Resuming {prompts_path} at line {start_line + 1}")
+    recorded = _recorded_ids(results_path)
+
+    try:
+        staged = StagedGenerator(generator).start()
+    except RuntimeError:
+        print("❌ Model failed to load; nothing generated")
+        return 0, 0, 0
+
+    if pipelined is None:
+        pipelined = generator.device == "cuda"
+    in_flight = IN_FLIGHT if pipelined else 0
+    counts = {"done": 0, "skipped": 0, "failed": 0}
+    # Lines in input order: (line_no, outcome, entry, generation, future, started)
+    pending = deque()
+
+    def flush(in_flight):
+        # Record finished lines, oldest first, until at most in_flight are generating
+        while pending:
+            line_no, outcome, entry, generation, future, started = pending[0]
+            if generation is not None:
+                if len(pending) <= in_flight and not future.done():
+                    break
+                entry, image_path, _, _ = generation
+                outcome, entry = _save_item(future.result(), entry, image_path, started)
+            pending.popleft()
+            if outcome is not None:
+                counts[outcome] += 1
+            if entry is not None:
+                results.write(json.dumps(entry, sort_keys=True) + "\n")
+                results.flush()
+            _write_json_atomic(checkpoint_path, {"source": source_id, "next_line": line_no + 1})
+
+    with open(prompts_path, encoding="utf-8") as source, open(results_path, "a", encoding="utf-8") as results:
+        try:
+            for line_no, line in enumerate(source):
+                if line_no < start_line:
+                    continue
+                line = line.strip()
+                outcome = entry = generation = future = started = None
+                if line and not line.startswith("#"):
+                    outcome, entry, generation = _plan_item(line, line_no, out_dir, defaults, recorded)
+                if generation is not None:
+                    _, _, prompt, kwargs = generation
+                    started = time.perf_counter()
+                    submit = staged.submit_guided if kwargs.pop("guided", False) else staged.submit
+                    try:
+                        future = submit(prompt, **kwargs)
+                    except (ValueError, KeyError, TypeError) as e:
+                        # e.g. an unknown trait or too few steps; record it and keep going
+                        print(f"❌ Line {line_no + 1}: invalid item ({e})")
+                        entry, _, _, _ = generation
+                        outcome, entry = "failed", dict(entry, status="invalid", error=str(e))
+                        generation = started = None
+                pending.append((line_no, outcome, entry, generation, future, started))
+                flush(in_flight)
+            flush(0)
+        finally:
+            staged.close()
+
+    print(
+        f"📦 Batch finished: {counts['done']} generated, {counts['skipped']} skipped, "
+        f"{counts['failed']} failed"
+    )
+    print(f"   Results: {results_path}")
+    return counts["done"], counts["skipped"], counts["failed"]
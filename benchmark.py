@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Generation Benchmarks
+Compares optional speed-ups of AIAvatarGenerator against the default path.
+Every mode renders the same prompts with the same fixed seeds, so besides
+timings each image can be compared pixel by pixel with its baseline.
+
+Usage:
+    python benchmark.py deepcache --intervals 2 3 5
+    python benchmark.py tome --ratios 0.3 0.5 0.7
+    python benchmark.py guidance --cutoffs 0.3 0.5 --thresholds 0.991
+    python benchmark.py decode --tiny-vae taesdxl
+    python benchmark.py --size 512 --steps 4 soak --images 300
+"""
+
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from adaptive_guidance import GUIDANCE_THRESHOLD
+from ai_avatar_generator import IMAGE_SIZE, MODEL_ID, NUM_INFERENCE_STEPS, VARIATION_STRENGTH, AIAvatarGenerator
+from generation_metrics import rss_bytes
+from tiny_vae import TINY_VAE_PATH
+
+# Fixed inputs so runs are comparable across machines and commits
+BENCHMARK_PROMPTS = ["a brave warrior knight with golden armor", "an elf archer with a green cloak"]
+BENCHMARK_SEEDS = [1, 2]
+
+
+def image_difference(image, reference):
+    """Mean absolute pixel difference (0-255) and PSNR in dB between two images"""
+    a = np.asarray(image.convert("RGB"), dtype=np.float64)
+    b = np.asarray(reference.convert("RGB"), dtype=np.float64)
+    mae = float(np.abs(a - b).mean())
+    mse = float(((a - b) ** 2).mean())
+    psnr = float("inf") if mse == 0 else 10 * np.log10(255**2 / mse)
+    return mae, psnr
+
+
+def run_modes(generator, modes, prompts=BENCHMARK_PROMPTS, seeds=BENCHMARK_SEEDS, **common):
+    """Generate every prompt/seed in every mode; returns {mode: [(image, record), ...]}
+
+    modes maps a label to extra generate_avatar keyword arguments; the first
+    mode is the baseline. One warm-up image is generated (and discarded)
+    first so lazy initialisation does not count against any mode.
+    """
+    generator.generate_avatar(prompts[0], seed=seeds[0], **common)
+    results = {}
+    for label, options in modes.items():
+        print(f"⏱️  {label}")
+        results[label] = []
+        for prompt in prompts:
+            for seed in seeds:
+                image = generator.generate_avatar(prompt, seed=seed, **common, **options)
+                if image is None:
+                    raise RuntimeError(f"Generation failed in mode '{label}'")
+                results[label].append((image, generator.metrics.last_record))
+    return results
+
+
+def print_comparison(results):
+    """Speed, memory and image difference of each mode against the first"""
+    baseline_label, baseline = next(iter(results.items()))
+    baseline_denoise = sum(record["stages_s"]["denoise"] for _, record in baseline)
+    baseline_total = sum(record["total_s"] for _, record in baseline)
+
+    print()
+    print(f"{'mode':<24} {'denoise s':>10} {'total s':>9} {'speedup':>8} {'peak VRAM':>10} {'MAE':>7} {'PSNR dB':>8}")
+    for label, runs in results.items():
+        denoise = sum(record["stages_s"]["denoise"] for _, record in runs)
+        total = sum(record["total_s"] for _, record in runs)
+        vram = max(record["peak_vram_bytes"] or 0 for _, record in runs)
+        differences = [image_difference(image, reference) for (image, _), (reference, _) in zip(runs, baseline)]
+        mae = sum(d[0] for d in differences) / len(differences)
+        psnr = min(d[1] for d in differences)
+        print(
+            f"{label:<24} {denoise / len(runs):>10.2f} {total / len(runs):>9.2f} "
+            f"{baseline_total / total:>7.2f}x {vram / 1024**2:>8.0f}MB {mae:>7.2f} {psnr:>8.1f}"
+        )
+    print(f"\n(per image averages; speedup is total time vs '{baseline_label}', PSNR is the worst image)")
+    print(f"Baseline denoising: {baseline_denoise / len(baseline):.2f}s per image")
+
+
+def benchmark_deepcache(generator, args, **common):
+    modes = {"baseline": {}}
+    for interval in args.intervals:
+        modes[f"deepcache every {interval}"] = {"deepcache_interval": interval}
+    results = run_modes(generator, modes, **common)
+    print_comparison(results)
+    for label, runs in results.items():
+        deepcache = runs[0][1].get("deepcache")
+        if deepcache:
+            print(
+                f"{label}: {deepcache['full_steps']} full / {deepcache['cached_steps']} cached UNet passes per image"
+            )
+
+
+def benchmark_tome(generator, args, **common):
+    modes = {"baseline": {}}
+    for ratio in args.ratios:
+        modes[f"token merging {ratio:g}"] = {"token_merging": ratio}
+    results = run_modes(generator, modes, **common)
+    print_comparison(results)
+    for label, runs in results.items():
+        merging = runs[0][1].get("token_merging")
+        if merging and merging["tokens_in"]:
+            kept = merging["tokens_out"] / merging["tokens_in"]
+            # Attention scores are tokens x tokens, so their size shrinks with the square
+            print(
+                f"{label}: {kept:.0%} of tokens reach merged self-attention, "
+                f"attention score memory {kept**2:.0%} of baseline"
+            )
+        elif merging:
+            print(f"{label}: no attention layer was small enough to merge at this size")
+
+
+def benchmark_guidance(generator, args, **common):
+    modes = {"baseline": {}}
+    for cutoff in args.cutoffs:
+        modes[f"guidance cutoff {cutoff:g}"] = {"guidance_cutoff": cutoff}
+    for threshold in args.thresholds:
+        modes[f"guidance until {threshold:g}"] = {"guidance_threshold": threshold}
+    results = run_modes(generator, modes, **common)
+    print_comparison(results)
+    for label, runs in results.items():
+        schedules = [record["guidance"] for _, record in runs if record.get("guidance")]
+        if schedules:
+            evaluations = sum(schedule["unet_evaluations"] for schedule in schedules) / len(schedules)
+            saved = sum(schedule["saved_evaluations"] for schedule in schedules) / len(schedules)
+            print(f"{label}: {evaluations:.1f} UNet evaluations per image, {saved:.1f} saved")
+
+
+def measure_peak(generator, run):
+    """Run run(); returns (seconds, peak memory above the starting level in bytes)
+
+    Peak VRAM on CUDA; on CPU the RSS is sampled from a second thread.
+    """
+    if generator.device == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        start_memory = torch.cuda.memory_allocated()
+        start = time.perf_counter()
+        result = run()
+        torch.cuda.synchronize()
+        seconds = time.perf_counter() - start
+        return result, seconds, torch.cuda.max_memory_allocated() - start_memory
+
+    start_memory = peak = rss_bytes()
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.wait(0.001):
+            peak = max(peak, rss_bytes())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    result = run()
+    seconds = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    return result, seconds, max(peak, rss_bytes()) - start_memory
+
+
+def benchmark_decode(generator, args, **common):
+    """Decode the same latents with the full VAE and the tiny decoder"""
+    if generator.tiny_vae is None:
+        print("❌ No tiny VAE loaded; pass --tiny-vae PATH")
+        return 1
+    latents = []
+    for prompt in BENCHMARK_PROMPTS:
+        for seed in BENCHMARK_SEEDS:
+            image = generator.generate_avatar(prompt, seed=seed, full_vae=True, **common)
+            if image is None:
+                raise RuntimeError("Generation failed")
+            latents.append(generator.latent_cache[image.info["cache_key"]])
+
+    def decode(sample, tiny):
+        decoded = generator.decode_latents(sample, tiny=tiny)
+        return generator.pipeline.image_processor.postprocess(decoded, output_type="pil")[0]
+
+    results = {}
+    for label, tiny in (("full VAE", False), ("tiny VAE", True)):
+        decode(latents[0], tiny)  # warm-up
+        results[label] = []
+        for sample in latents:
+            for _ in range(args.repeats):
+                results[label].append(measure_peak(generator, lambda: decode(sample, tiny)))
+
+    print()
+    print(f"{'decoder':<10} {'decode s':>9} {'speedup':>8} {'peak mem':>9} {'MAE':>7} {'PSNR dB':>8}")
+    full_runs = results["full VAE"]
+    full_seconds = sum(seconds for _, seconds, _ in full_runs)
+    for label, runs in results.items():
+        seconds = sum(seconds for _, seconds, _ in runs)
+        peak = max(peak for _, _, peak in runs)
+        differences = [image_difference(image, reference) for (image, _, _), (reference, _, _) in zip(runs, full_runs)]
+        mae = sum(d[0] for d in differences) / len(differences)
+        psnr = min(d[1] for d in differences)
+        print(
+            f"{label:<10} {seconds / len(runs):>9.3f} {full_seconds / seconds:>7.2f}x "
+            f"{peak / 1024**2:>7.0f}MB {mae:>7.2f} {psnr:>8.1f}"
+        )
+    memory = "VRAM" if generator.device == "cuda" else "RSS"
+    print(f"\n(per decode averages; peak mem is the largest {memory} increase during one decode)")
+    return 0
+
+
+def benchmark_soak(generator, args, **common):
+    """Generate many images and fail if RSS keeps growing once warmed up"""
+    rss = []
+    previous = None
+    # At least one denoising step per variation, even with very few --steps
+    steps = common["num_inference_steps"]
+    strength = max(VARIATION_STRENGTH, 1 / steps)
+    for i in range(args.images):
+        prompt = BENCHMARK_PROMPTS[i % len(BENCHMARK_PROMPTS)]
+        # Every third job is a variation so the img2img path is covered too
+        if previous is not None and i % 3 == 2:
+            image = generator.generate_variation(previous, prompt, seed=i, num_inference_steps=steps, strength=strength)
+        else:
+            image = generator.generate_avatar(prompt, seed=i, **common)
+        if image is None:
+            raise RuntimeError(f"Generation {i} failed")
+        previous = image
+        memory = generator.metrics.last_record["memory"]
+        rss.append(memory["rss_bytes"])
+        if (i + 1) % max(1, args.images // 10) == 0:
+            vram = memory.get("vram_reserved_bytes")
+            vram_text = f", VRAM reserved {vram / 1024**2:.0f}MB" if vram is not None else ""
+            print(f"🧪 {i + 1}/{args.images}: RSS {rss[-1] / 1024**2:.0f}MB{vram_text}")
+
+    # Allocator pools and caches fill up during the first half; after that the trend must be flat
+    settled = rss[len(rss) // 2 :]
+    slope = np.polyfit(np.arange(len(settled)), settled, 1)[0]
+    growth = slope * 100 / 1024**2
+    print(
+        f"\nRSS: start {rss[0] / 1024**2:.0f}MB, end {rss[-1] / 1024**2:.0f}MB, "
+        f"peak {max(rss) / 1024**2:.0f}MB; trend over the second half {growth:+.2f}MB per 100 images"
+    )
+    if growth > args.max_growth:
+        print(f"❌ Memory grows faster than {args.max_growth}MB per 100 images")
+        return 1
+    print("✅ Memory is flat")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark optional generation speed-ups")
+    parser.add_argument("--model", default=MODEL_ID, help="Base model id or local directory")
+    parser.add_argument("--steps", type=int, default=NUM_INFERENCE_STEPS, help="Denoising steps per image")
+    parser.add_argument("--size", type=int, default=IMAGE_SIZE, help="Image width and height")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    deepcache = commands.add_parser("deepcache", help="UNet feature caching at several intervals")
+    deepcache.add_argument("--intervals", type=int, nargs="+", default=[2, 3, 5], help="Full UNet pass every N steps")
+    deepcache.set_defaults(run=benchmark_deepcache)
+
+    tome = commands.add_parser("tome", help="Token merging at several ratios")
+    tome.add_argument("--ratios", type=float, nargs="+", default=[0.3, 0.5, 0.7], help="Fraction of tokens merged")
+    tome.set_defaults(run=benchmark_tome)
+
+    guidance = commands.add_parser("guidance", help="Classifier-free guidance truncation and adaptive guidance")
+    guidance.add_argument(
+        "--cutoffs", type=float, nargs="+", default=[0.3, 0.5], help="Fractions of the steps that keep guidance"
+    )
+    guidance.add_argument(
+        "--thresholds",
+        type=float,
+        nargs="*",
+        default=[GUIDANCE_THRESHOLD],
+        help="Cosine similarities at which guidance stops",
+    )
+    guidance.set_defaults(run=benchmark_guidance)
+
+    decode = commands.add_parser("decode", help="Decode time and memory of the tiny VAE against the full VAE")
+    decode.add_argument(
+        "--tiny-vae", type=Path, default=TINY_VAE_PATH, help=f"Tiny autoencoder file or directory (default: {TINY_VAE_PATH})"
+    )
+    decode.add_argument("--repeats", type=int, default=3, help="Timed decodes per image")
+    decode.set_defaults(run=benchmark_decode)
+
+    soak = commands.add_parser("soak", help="Many generations in one process; checks that memory stays flat")
+    soak.add_argument("--images", type=int, default=300, help="Number of generations")
+    soak.add_argument(
+        "--max-growth", type=float, default=16.0, help="Allowed RSS trend in MB per 100 images (default: 16)"
+    )
+    soak.set_defaults(run=benchmark_soak)
+
+    args = parser.parse_args()
+
+    # The generation cache would turn repeated seeds into instant hits
+    generator = AIAvatarGenerator(model_id=args.model, cache=False, tiny_vae=getattr(args, "tiny_vae", None))
+    generator.load_model()
+    if not generator.model_loaded:
+        return 1
+    return args.run(generator, args, num_inference_steps=args.steps, width=args.size, height=args.size) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+UNet Feature Caching (DeepCache)
+High-level UNet features change slowly between adjacent denoising steps. On
+a full step every block runs and the outputs of the deep, low-resolution
+blocks are kept. For the next interval - 1 steps those blocks hand back the
+kept outputs and only the outermost down and up blocks (full latent
+resolution) are recomputed, with fresh skip connections.
+
+Based on Ma et al., "DeepCache: Accelerating Diffusion Models for Free" (2023).
+"""
+
+# Full UNet pass every N steps (1 disables caching)
+DEEPCACHE_INTERVAL = 3
+
+
+class DeepCache:
+    """Context manager that makes a UNet reuse its deep features between full steps"""
+
+    def __init__(self, unet, interval=DEEPCACHE_INTERVAL):
+        if interval < 1:
+            raise ValueError(f"DeepCache interval must be at least 1, got {interval}")
+        self.unet = unet
+        self.interval = interval
+        self.calls = 0
+        self.full_steps = 0
+        self.full = True
+        self.input_shape = None
+        self.outputs = {}
+        self.saved_forwards = {}
+
+    @property
+    def cached_steps(self):
+        """UNet calls that skipped the deep blocks"""
+        return self.calls - self.full_steps
+
+    def __enter__(self):
+        unet = self.unet
+        deep_blocks = list(unet.down_blocks[1:]) + [unet.mid_block] + list(unet.up_blocks[:-1])
+        self._patch(unet, self._wrap_unet(unet.forward))
+        for block in deep_blocks:
+            self._patch(block, self._wrap_block(block, block.forward))
+        return self
+
+    def __exit__(self, *exc):
+        # Put back whatever forward the instances had (e.g. offload hooks)
+        for module, forward in self.saved_forwards.items():
+            if forward is None:
+                del module.forward
+            else:
+                module.forward = forward
+        self.saved_forwards.clear()
+        self.outputs.clear()
+
+    def _patch(self, module, forward):
+        self.saved_forwards[module] = module.__dict__.get("forward")
+        module.forward = forward
+
+    def _wrap_unet(self, forward):
+        def cached_unet_forward(sample, *args, **kwargs):
+            # A new batch or resolution cannot reuse features from the old one
+            shape = tuple(sample.shape)
+            self.full = self.calls % self.interval == 0 or shape != self.input_shape
+            if self.full:
+                self.full_steps += 1
+                self.input_shape = shape
+            self.calls += 1
+            return forward(sample, *args, **kwargs)
+
+        return cached_unet_forward
+
+    def _wrap_block(self, block, forward):
+        def cached_block_forward(*args, **kwargs):
+            if self.full or block not in self.outputs:
+                self.outputs[block] = forward(*args, **kwargs)
+            return self.outputs[block]
+
+        return cached_block_forward
@@ -2,12 +2,19 @@
 """
 Fantasy Pixel Avatar Generator - Rewritten with proper alignment
 Click anywhere or press R to generate a new random avatar
-Press S to save the current avatar
+Press A to play the current avatar's idle animation
+Press S to save the current avatar (or animation)
+Press C to save every skin/hair/cloth colour variant of the current avatar
 """
 
+import itertools
+import json
 import pygame
+import queue
 import random
 import sys
+import threading
+from collections import deque
 from datetime import datetime
 from pathlib import Path
 
@@ -28,11 +35,191 @@ HEAD_Y = CENTER_Y - 8  # Head starts above center
 BODY_Y = CENTER_Y + 16  # Body starts below head
 NECK_Y = CENTER_Y + 8  # Neck position
 
+# Part catalogue: body, hair styles, hats, accessories and mouths
+PARTS_FILE = Path(__file__).with_name("avatar_parts.json")
+
+# Grid points that part offsets are measured from
+ANCHORS = {
+    "head": (CENTER_X, HEAD_Y),
+    "neck": (CENTER_X, NECK_Y),
+    "body": (CENTER_X, BODY_Y),
+}
+
+# Traits picked from the part catalogue (trait -> part kind), in sampling
+# order: a part's "hides" list can leave later kinds out entirely
+PART_TRAITS = {"hat": "hat", "accessory": "accessory", "hair_style": "hair", "mouth": "mouth"}
+
+# Recolourable traits of indexed renders, each drawn in a placeholder colour
+# that only has to differ from every fixed colour of the avatar
+SLOT_COLORS = {
+    "skin": (1, 0, 1),
+    "hair_color": (2, 0, 2),
+    "cloth": (3, 0, 3),
+    "cloth_dark": (4, 0, 4),
+    "hat_color": (5, 0, 5),
+    "accessory_color": (6, 0, 6),
+}
+
+# Random avatars rendered ahead of time in the background
+PREFETCH_SIZE = 8
+
+# Memory budget for previously shown avatars (Backspace goes back)
+HISTORY_MAX_BYTES = 32 * 1024 * 1024
+
+# How long the instructions overlay stays up (ms)
+INSTRUCTIONS_MS = 5000
+
+# Animation timing
+FRAME_MS = 120
+
+# Per-frame overrides of an avatar's traits:
+#   gaze  - pupil offset (-1 left, 0 centre, 1 right)
+#   mouth - mouth shape ("smile", "neutral", "cute", "open")
+#   blink - eyes closed
+#   bob   - vertical offset of the whole figure in grid pixels
+ANIMATIONS = {
+    "blink": [{}] * 6 + [{"blink": True}] * 2,
+    "look": [{"gaze": -1}] * 4 + [{"gaze": 0}] * 2 + [{"gaze": 1}] * 4 + [{"gaze": 0}] * 2,
+    "bob": [{"bob": 0}] * 2 + [{"bob": -1}] * 2,
+    "talk": [{"mouth": mouth} for mouth in ("open", "neutral", "open", "smile", "open", "neutral")],
+    "idle": [
+        {"bob": -((i // 4) % 2), "blink": i in (10, 11), "gaze": (0, 0, -1, -1, 0, 0, 1, 1)[i // 2]}
+        for i in range(16)
+    ],
+}
+
+
+class AliasTable:
+    """Weighted random choice in constant time (Vose's alias method)
+    
+    Built once in O(n); each sample then costs one random number and one
+    comparison however many items there are.
+    """
+    
+    def __init__(self, items, weights):
+        self.items = list(items)
+        n = len(self.items)
+        total = sum(weights)
+        if n == 0 or total <= 0 or min(weights) < 0:
+            raise ValueError("An alias table needs at least one positive weight and none negative")
+        scaled = [weight * n / total for weight in weights]
+        self.probability = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] += scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+    
+    def sample(self, rng=random):
+        u = rng.random() * len(self.items)
+        i = int(u)
+        return self.items[i if u - i < self.probability[i] else self.alias[i]]
+
+
+class Part:
+    """A part compiled once into an 8-bit stamp for single-blit drawing
+    
+    Each character of the part's rows becomes a palette index (0 is
+    transparent), so drawing it in any colours is just a palette swap. A
+    colour is either a fixed RGB value or the name of a slot such as "hair"
+    that is filled in at draw time.
+    """
+    
+    def __init__(self, name, definition):
+        self.name = name
+        self.weight = definition.get("weight", 1)
+        self.hides = definition.get("hides", [])  # part kinds this part covers completely
+        self.choices = [tuple(color) for color in definition.get("choices", [])]
+        legend = definition.get("colors", {})
+        self.colors = [color if isinstance(color, str) else tuple(color) for color in legend.values()]
+        self.stamp = None
+        self.tinted = {}  # resolved palette -> stamp in those colours
+        
+        rows = definition.get("rows", [])
+        if not rows:
+            return  # e.g. "none" or "bald"
+        
+        index = {char: i + 1 for i, char in enumerate(legend)}
+        anchor_x, anchor_y = ANCHORS[definition["anchor"]]
+        offset_x, offset_y = definition["offset"]
+        self.position = ((anchor_x + offset_x) * PIXEL_SIZE, (anchor_y + offset_y) * PIXEL_SIZE)
+        
+        width = max(len(row) for row in rows)
+        self.stamp = pygame.Surface((width * PIXEL_SIZE, len(rows) * PIXEL_SIZE), depth=8)
+        self.stamp.fill(0)
+        for y, row in enumerate(rows):
+            for x, char in enumerate(row):
+                if char == ".":
+                    continue
+                if char not in index:
+                    raise ValueError(f"Part '{name}': '{char}' is not listed in its colors")
+                self.stamp.fill(index[char], (x * PIXEL_SIZE, y * PIXEL_SIZE, PIXEL_SIZE, PIXEL_SIZE))
+        self.stamp.set_colorkey(0)
+    
+    def draw(self, surface, slots=None):
+        """Blit the part with its colour slots filled from slots"""
+        if self.stamp is None:
+            return
+        palette = tuple(slots[color] if isinstance(color, str) else color for color in self.colors)
+        image = self.tinted.get(palette)
+        if image is None:
+            image = self.stamp.copy()
+            image.set_palette([(0, 0, 0)] + list(palette))
+            self.tinted[palette] = image
+        surface.blit(image, self.position)
+
+
+def darken(color, amount=40):
+    """Shade of color used for collars and trims"""
+    return tuple(max(0, c - amount) for c in color)
+
+
+def load_parts(path=PARTS_FILE):
+    """Compile the part catalogue: {kind: {name: Part}}"""
+    with open(path, encoding="utf-8") as f:
+        catalogue = json.load(f)
+    return {
+        kind: {name: Part(name, definition) for name, definition in parts.items()}
+        for kind, parts in catalogue.items()
+    }
+
+
+class IndexedAvatar:
+    """An avatar drawn once as 8-bit palette indices
+    
+    Skin, hair, cloth, hat and accessory colours each own a palette entry,
+    so a colour variant is a palette swap on the same pixels rather than a
+    redraw, and saving the surface writes a palettized PNG.
+    """
+    
+    def __init__(self, surface, slots):
+        self.surface = surface  # 8-bit, SCREEN_WIDTH x SCREEN_HEIGHT
+        self.slots = slots  # trait -> palette index; traits not drawn are absent
+    
+    def recolor(self, **colors):
+        """Set slot colours (skin=..., hair_color=..., cloth=...); returns the surface
+        
+        The surface is recoloured in place; copy it to keep a variant.
+        """
+        if "cloth" in colors:
+            colors.setdefault("cloth_dark", darken(colors["cloth"]))
+        for trait, color in colors.items():
+            if trait not in SLOT_COLORS:
+                raise ValueError(f"'{trait}' is not a colour slot")
+            index = self.slots.get(trait)
+            if index is not None and color is not None:
+                self.surface.set_palette_at(index, color)
+        return self.surface
+
 
 class AvatarGenerator:
     """Main avatar generator class"""
     
-    def __init__(self):
+    def __init__(self, parts_file=PARTS_FILE):
         # Component options
         self.skin_colors = [
             (255, 220, 177),  # Peach
@@ -69,6 +256,55 @@ class AvatarGenerator:
             ("gradient", ((255, 180, 100), (150, 100, 180))),
             ("gradient", ((200, 220, 255), (60, 100, 180))),
         ]
+        
+        # Body shapes, hair styles, hats, accessories and mouths
+        self.parts = load_parts(parts_file)
+        self.tables = {
+            kind: AliasTable(parts, [part.weight for part in parts.values()])
+            for kind, parts in self.parts.items()
+        }
+        
+        # Backgrounds are painted once per style and then copied
+        self.background_cache = {}
+    
+    def pick(self, kind, rng=random):
+        """Pick a random part name of one kind, honouring part weights"""
+        return self.tables[kind].sample(rng)
+    
+    def random_traits(self, rng=random, **fixed):
+        """Pick every random choice for one avatar; traits given in fixed are kept
+        
+        Part traits hidden by an earlier pick (e.g. hair under a hood) are
+        None and are neither sampled nor drawn. Pass a seeded random.Random
+        as rng to get the same avatar every time.
+        """
+        options = {
+            "skin": self.skin_colors,
+            "hair_color": self.hair_colors,
+            "cloth": self.cloth_colors,
+            "background": self.backgrounds,
+            "gaze": (-1, 0, 1),
+        }
+        unknown = set(fixed) - set(options) - set(PART_TRAITS) - {"hat_color", "accessory_color"}
+        if unknown:
+            raise ValueError(f"Unknown avatar traits: {', '.join(sorted(unknown))}")
+        traits = {trait: fixed[trait] if trait in fixed else rng.choice(values) for trait, values in options.items()}
+        hidden = set()
+        for trait, kind in PART_TRAITS.items():
+            if kind in hidden:
+                traits[trait] = None
+                continue
+            traits[trait] = fixed[trait] if trait in fixed else self.pick(kind, rng)
+            if traits[trait] not in self.parts[kind]:
+                raise ValueError(
+                    f"Unknown {trait} {traits[trait]!r} "
+                    f"(choose from {', '.join(sorted(self.parts[kind]))})"
+                )
+            hidden.update(self.parts[kind][traits[trait]].hides)
+        for trait, kind in (("hat_color", "hat"), ("accessory_color", "accessory")):
+            choices = self.parts[kind][traits[kind]].choices
+            traits[trait] = fixed.get(trait) or (rng.choice(choices) if choices else None)
+        return traits
     
     def draw_pixel(self, surface, color, gx, gy, w=1, h=1):
         """Draw a pixel at grid coordinates"""
@@ -83,222 +319,246 @@ class AvatarGenerator:
         if bg_style == "solid":
             surface.fill(bg_data)
         elif bg_style == "gradient":
-            top_color, bottom_color = bg_data
-            for y in range(GRID_HEIGHT):
-                t = y / GRID_HEIGHT
-                r = int(top_color[0] * (1 - t) + bottom_color[0] * t)
-                g = int(top_color[1] * (1 - t) + bottom_color[1] * t)
-                b = int(top_color[2] * (1 - t) + bottom_color[2] * t)
-                for x in range(GRID_WIDTH):
-                    self.draw_pixel(surface, (r, g, b), x, y)
-    
-    def draw_body(self, surface, cloth_color):
+            if bg_type not in self.background_cache:
+                painted = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+                top_color, bottom_color = bg_data
+                for y in range(GRID_HEIGHT):
+                    t = y / GRID_HEIGHT
+                    r = int(top_color[0] * (1 - t) + bottom_color[0] * t)
+                    g = int(top_color[1] * (1 - t) + bottom_color[1] * t)
+                    b = int(top_color[2] * (1 - t) + bottom_color[2] * t)
+                    self.draw_pixel(painted, (r, g, b), 0, y, GRID_WIDTH, 1)
+                self.background_cache[bg_type] = painted
+            surface.blit(self.background_cache[bg_type], (0, 0))
+    
+    def draw_body(self, surface, cloth_color, dark_cloth=None):
         """Draw body/torso"""
-        # Shoulders (wide rectangle)
-        for y in range(4):
-            for x in range(-10, 11):
-                self.draw_pixel(surface, cloth_color, CENTER_X + x, BODY_Y + y)
-        
-        # Torso (narrower, extends down)
-        for y in range(4, 20):
-            width = 8
-            for x in range(-width, width + 1):
-                self.draw_pixel(surface, cloth_color, CENTER_X + x, BODY_Y + y)
-        
-        # Add simple details (darker shade for outline)
-        dark_cloth = tuple(max(0, c - 40) for c in cloth_color)
-        # Collar
-        for x in range(-6, 7):
-            self.draw_pixel(surface, dark_cloth, CENTER_X + x, BODY_Y)
+        if dark_cloth is None:
+            dark_cloth = darken(cloth_color)  # Collar
+        self.parts["base"]["body"].draw(surface, {"cloth": cloth_color, "cloth_dark": dark_cloth})
     
     def draw_neck(self, surface, skin_color):
         """Draw neck connecting head to body"""
-        for y in range(4):
-            for x in range(-3, 4):
-                self.draw_pixel(surface, skin_color, CENTER_X + x, NECK_Y + y)
+        self.parts["base"]["neck"].draw(surface, {"skin": skin_color})
     
     def draw_head(self, surface, skin_color):
-        """Draw head (oval shape)"""
-        # Main head shape (centered)
-        for y in range(12):
-            if y < 3 or y > 8:
-                width = 6  # Narrower at top and bottom
-            else:
-                width = 8  # Wider in middle
+        """Draw head (oval shape) with ears"""
+        self.parts["base"]["head"].draw(surface, {"skin": skin_color})
+    
+    def draw_face(self, surface, pupil_offset=None, mouth_type=None, blink=False):
+        """Draw facial features (gaze and mouth are random unless given)"""
+        if blink:
+            # Closed eyes
+            self.draw_pixel(surface, (0, 0, 0), CENTER_X - 4, HEAD_Y + 6, 3, 1)
+            self.draw_pixel(surface, (0, 0, 0), CENTER_X + 2, HEAD_Y + 6, 3, 1)
+        else:
+            # Eyes (white)
+            self.draw_pixel(surface, (255, 255, 255), CENTER_X - 4, HEAD_Y + 5, 3, 2)
+            self.draw_pixel(surface, (255, 255, 255), CENTER_X + 2, HEAD_Y + 5, 3, 2)
             
-            for x in range(-width, width + 1):
-                self.draw_pixel(surface, skin_color, CENTER_X + x, HEAD_Y + y)
-        
-        # Ears
-        self.draw_pixel(surface, skin_color, CENTER_X - 9, HEAD_Y + 5, 2, 3)
-        self.draw_pixel(surface, skin_color, CENTER_X + 8, HEAD_Y + 5, 2, 3)
-    
-    def draw_face(self, surface):
-        """Draw facial features"""
-        # Eyes (white)
-        self.draw_pixel(surface, (255, 255, 255), CENTER_X - 4, HEAD_Y + 5, 3, 2)
-        self.draw_pixel(surface, (255, 255, 255), CENTER_X + 2, HEAD_Y + 5, 3, 2)
-        
-        # Pupils (black)
-        pupil_offset = random.choice([-1, 0, 1])  # Random gaze direction
-        self.draw_pixel(surface, (0, 0, 0), CENTER_X - 3 + pupil_offset, HEAD_Y + 5)
-        self.draw_pixel(surface, (0, 0, 0), CENTER_X + 3 + pupil_offset, HEAD_Y + 5)
+            # Pupils (black)
+            if pupil_offset is None:
+                pupil_offset = random.choice([-1, 0, 1])  # Random gaze direction
+            self.draw_pixel(surface, (0, 0, 0), CENTER_X - 3 + pupil_offset, HEAD_Y + 5)
+            self.draw_pixel(surface, (0, 0, 0), CENTER_X + 3 + pupil_offset, HEAD_Y + 5)
         
         # Mouth (random expression)
-        mouth_type = random.choice(["smile", "neutral", "cute"])
-        
-        if mouth_type == "smile":
-            # Curved smile
-            for x in range(-2, 3):
-                self.draw_pixel(surface, (0, 0, 0), CENTER_X + x, HEAD_Y + 9)
-            self.draw_pixel(surface, (0, 0, 0), CENTER_X - 3, HEAD_Y + 8)
-            self.draw_pixel(surface, (0, 0, 0), CENTER_X + 3, HEAD_Y + 8)
-        elif mouth_type == "neutral":
-            # Straight line
-            for x in range(-2, 3):
-                self.draw_pixel(surface, (0, 0, 0), CENTER_X + x, HEAD_Y + 9)
-        else:  # cute
-            # Small round mouth
-            self.draw_pixel(surface, (255, 150, 150), CENTER_X, HEAD_Y + 9, 2, 2)
-            # Blush
-            self.draw_pixel(surface, (255, 180, 180), CENTER_X - 6, HEAD_Y + 7, 2, 1)
-            self.draw_pixel(surface, (255, 180, 180), CENTER_X + 5, HEAD_Y + 7, 2, 1)
-    
-    def draw_hair(self, surface, hair_color):
+        if mouth_type is None:
+            mouth_type = self.pick("mouth")
+        self.parts["mouth"][mouth_type].draw(surface)
+    
+    def draw_hair(self, surface, hair_color, hair_style=None):
         """Draw hair"""
-        hair_style = random.choice(["short", "long", "spiky", "bald"])
-        
-        if hair_style == "bald":
-            return
-        
-        if hair_style == "short":
-            # Cover top and sides of head
-            for y in range(5):
-                width = 8 if y > 2 else 6
-                for x in range(-width, width + 1):
-                    self.draw_pixel(surface, hair_color, CENTER_X + x, HEAD_Y + y)
-        
-        elif hair_style == "long":
-            # Top of head
-            for y in range(5):
-                width = 8 if y > 2 else 6
-                for x in range(-width, width + 1):
-                    self.draw_pixel(surface, hair_color, CENTER_X + x, HEAD_Y + y)
-            # Long sides
-            for y in range(5, 12):
-                self.draw_pixel(surface, hair_color, CENTER_X - 8, HEAD_Y + y, 2, 1)
-                self.draw_pixel(surface, hair_color, CENTER_X + 7, HEAD_Y + y, 2, 1)
-        
-        else:  # spiky
-            # Base
-            for y in range(5):
-                width = 8 if y > 2 else 6
-                for x in range(-width, width + 1):
-                    self.draw_pixel(surface, hair_color, CENTER_X + x, HEAD_Y + y)
-            # Spikes
-            for spike_x in [-6, -2, 2, 6]:
-                for spike_y in range(3):
-                    self.draw_pixel(surface, hair_color, CENTER_X + spike_x, HEAD_Y - spike_y)
-    
-    def draw_hat(self, surface):
+        if hair_style is None:
+            hair_style = self.pick("hair")
+        self.parts["hair"][hair_style].draw(surface, {"hair": hair_color})
+    
+    def draw_hat(self, surface, hat_type=None, hat_color=None):
         """Draw hat/headwear"""
-        hat_type = random.choice(["none", "none", "wizard", "crown", "helmet", "hood"])
-        
-        if hat_type == "none":
-            return
+        if hat_type is None:
+            hat_type = self.pick("hat")
+        part = self.parts["hat"][hat_type]
+        if hat_color is None and part.choices:
+            hat_color = random.choice(part.choices)
+        part.draw(surface, {"hat": hat_color})
+    
+    def draw_accessory(self, surface, acc_type=None, acc_color=None):
+        """Draw necklace or accessory"""
+        if acc_type is None:
+            acc_type = self.pick("accessory")
+        part = self.parts["accessory"][acc_type]
+        if acc_color is None and part.choices:
+            acc_color = random.choice(part.choices)
+        part.draw(surface, {"accessory": acc_color})
+    
+    def generate(self, surface):
+        """Generate a complete random avatar; returns its traits"""
+        traits = self.random_traits()
+        self.render(surface, traits)
+        return traits
+    
+    def render(self, surface, traits):
+        """Draw the avatar described by traits"""
+        self.draw_background(surface, traits["background"])
+        self.draw_under_face(surface, traits)
+        self.draw_face(surface, traits["gaze"], traits["mouth"])
+        self.draw_over_face(surface, traits)
+    
+    def render_indexed(self, traits):
+        """Draw the avatar described by traits as an IndexedAvatar"""
+        keyed = dict(traits)
+        for trait, placeholder in SLOT_COLORS.items():
+            if trait == "cloth_dark" or keyed.get(trait) is not None:
+                keyed[trait] = placeholder
+        surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+        self.render(surface, keyed)
         
-        if hat_type == "wizard":
-            # Wizard hat (tall cone)
-            hat_color = random.choice([(50, 50, 120), (120, 50, 120), (50, 120, 50)])
-            # Brim
-            for x in range(-10, 11):
-                self.draw_pixel(surface, hat_color, CENTER_X + x, HEAD_Y)
-            # Cone
-            for h in range(8):
-                width = 6 - h // 2
-                for x in range(-width, width + 1):
-                    self.draw_pixel(surface, hat_color, CENTER_X + x, HEAD_Y - h)
-            # Star
-            self.draw_pixel(surface, (255, 255, 100), CENTER_X, HEAD_Y - 8)
+        # Everything is drawn on the grid, so one pixel per cell has every colour
+        grid = pygame.image.tobytes(pygame.transform.scale(surface, (GRID_WIDTH, GRID_HEIGHT)), "RGB")
+        palette = {}  # RGB bytes -> index, in order of first appearance
+        indices = bytearray(GRID_WIDTH * GRID_HEIGHT)
+        for i in range(len(indices)):
+            indices[i] = palette.setdefault(grid[3 * i : 3 * i + 3], len(palette)) & 0xFF
+        if len(palette) > 256:
+            raise ValueError(f"Avatar uses {len(palette)} colours; an indexed render holds 256")
         
-        elif hat_type == "crown":
-            # Crown
-            gold = (255, 215, 0)
-            for x in range(-6, 7):
-                self.draw_pixel(surface, gold, CENTER_X + x, HEAD_Y)
-            # Points
-            for x in [-5, 0, 5]:
-                self.draw_pixel(surface, gold, CENTER_X + x, HEAD_Y - 1, 1, 2)
-            # Gems
-            self.draw_pixel(surface, (255, 50, 50), CENTER_X - 5, HEAD_Y - 2)
-            self.draw_pixel(surface, (50, 255, 50), CENTER_X, HEAD_Y - 2)
-            self.draw_pixel(surface, (50, 50, 255), CENTER_X + 5, HEAD_Y - 2)
+        indexed = pygame.image.frombytes(bytes(indices), (GRID_WIDTH, GRID_HEIGHT), "P")
+        indexed.set_palette([tuple(color) for color in palette])
+        indexed = pygame.transform.scale(indexed, (SCREEN_WIDTH, SCREEN_HEIGHT))
+        slots = {
+            trait: palette[bytes(placeholder)]
+            for trait, placeholder in SLOT_COLORS.items()
+            if bytes(placeholder) in palette
+        }
+        avatar = IndexedAvatar(indexed, slots)
+        avatar.recolor(**{trait: traits.get(trait) for trait in SLOT_COLORS if trait != "cloth_dark"})
+        return avatar
+    
+    def color_variants(self, traits):
+        """Every skin x hair x cloth colouring of one avatar
         
-        elif hat_type == "helmet":
-            # Knight helmet
-            gray = (150, 150, 150)
-            for y in range(4):
-                width = 8 if y > 1 else 7
-                for x in range(-width, width + 1):
-                    self.draw_pixel(surface, gray, CENTER_X + x, HEAD_Y + y)
-            # Horns
-            self.draw_pixel(surface, (200, 200, 180), CENTER_X - 9, HEAD_Y, 2, 3)
-            self.draw_pixel(surface, (200, 200, 180), CENTER_X + 8, HEAD_Y, 2, 3)
+        Yields ((skin, hair, cloth) option indices, surface). The avatar is
+        drawn once and the same surface is recoloured for each variant.
+        """
+        avatar = self.render_indexed(traits)
+        options = (self.skin_colors, self.hair_colors, self.cloth_colors)
+        for combo in itertools.product(*(range(len(colors)) for colors in options)):
+            skin, hair, cloth = (colors[i] for colors, i in zip(options, combo))
+            yield combo, avatar.recolor(skin=skin, hair_color=hair, cloth=cloth)
+    
+    def draw_under_face(self, surface, traits):
+        """Layers drawn before the face: body, neck and head"""
+        self.draw_body(surface, traits["cloth"], traits.get("cloth_dark"))
+        self.draw_neck(surface, traits["skin"])
+        self.draw_head(surface, traits["skin"])
+    
+    def draw_over_face(self, surface, traits):
+        """Layers drawn after the face: hair, hat and accessory (hidden ones are skipped)"""
+        if traits["hair_style"] is not None:
+            self.draw_hair(surface, traits["hair_color"], traits["hair_style"])
+        if traits["hat"] is not None:
+            self.draw_hat(surface, traits["hat"], traits["hat_color"])
+        if traits["accessory"] is not None:
+            self.draw_accessory(surface, traits["accessory"], traits["accessory_color"])
+    
+    def animate(self, traits, frames=ANIMATIONS["idle"]):
+        """Render an animation of one avatar; returns a list of surfaces
         
-        else:  # hood
-            # Hood
-            hood_color = random.choice([(100, 80, 60), (60, 80, 60), (60, 60, 80)])
-            for y in range(6):
-                width = 10 if y > 2 else 8
-                for x in range(-width, width + 1):
-                    self.draw_pixel(surface, hood_color, CENTER_X + x, HEAD_Y + y)
-    
-    def draw_accessory(self, surface):
-        """Draw necklace or accessory"""
-        acc_type = random.choice(["none", "none", "pendant", "collar", "scarf"])
+        Each layer is drawn once: the background, the figure under and over
+        the face, and one face per distinct expression. Frames are composed
+        by blitting only the changed regions of those layers, and frames
+        with the same expression and bob share one surface.
+        """
+        size = (SCREEN_WIDTH, SCREEN_HEIGHT)
+        background = pygame.Surface(size)
+        self.draw_background(background, traits["background"])
         
-        if acc_type == "none":
-            return
+        def make_layer(draw, *args):
+            """Draw onto a transparent canvas and crop to the drawn pixels"""
+            canvas = pygame.Surface(size, pygame.SRCALPHA)
+            draw(canvas, *args)
+            # Parts are drawn on the grid, so the bounds can be found at grid resolution
+            grid = pygame.transform.scale(canvas, (GRID_WIDTH, GRID_HEIGHT)).get_bounding_rect()
+            area = pygame.Rect(
+                grid.x * PIXEL_SIZE, grid.y * PIXEL_SIZE, grid.w * PIXEL_SIZE, grid.h * PIXEL_SIZE
+            )
+            return canvas.subsurface(area).copy(), area.topleft
         
-        if acc_type == "pendant":
-            # Chain
-            for x in range(-2, 3):
-                self.draw_pixel(surface, (150, 150, 170), CENTER_X + x, NECK_Y + 3)
-            # Pendant
-            pendant_color = random.choice([(100, 200, 255), (255, 50, 50), (100, 255, 100)])
-            self.draw_pixel(surface, pendant_color, CENTER_X - 1, NECK_Y + 4, 2, 2)
+        def blit_layer(target, layer, offset):
+            image, (x, y) = layer
+            target.blit(image, (x + offset[0], y + offset[1]))
         
-        elif acc_type == "collar":
-            # Gold collar
-            for x in range(-6, 7):
-                self.draw_pixel(surface, (255, 215, 0), CENTER_X + x, NECK_Y + 3)
+        under = make_layer(self.draw_under_face, traits)
+        over = make_layer(self.draw_over_face, traits)
         
-        else:  # scarf
-            # Scarf
-            scarf_color = random.choice([(200, 50, 50), (50, 200, 50), (200, 200, 50)])
-            for x in range(-6, 7):
-                self.draw_pixel(surface, scarf_color, CENTER_X + x, NECK_Y + 3)
-            # Hanging ends
-            self.draw_pixel(surface, scarf_color, CENTER_X - 7, NECK_Y + 4, 1, 4)
-            self.draw_pixel(surface, scarf_color, CENTER_X + 7, NECK_Y + 4, 1, 4)
+        bases = {}  # bob -> background with the under-face layers
+        faces = {}  # (gaze, mouth, blink) -> face layer
+        composed = {}  # (face key, bob) -> frame
+        sequence = []
+        for state in frames:
+            key = (
+                state.get("gaze", traits["gaze"]),
+                state.get("mouth", traits["mouth"]),
+                state.get("blink", False),
+            )
+            bob = state.get("bob", 0)
+            if (key, bob) not in composed:
+                offset = (0, bob * PIXEL_SIZE)
+                if bob not in bases:
+                    bases[bob] = background.copy()
+                    blit_layer(bases[bob], under, offset)
+                if key not in faces:
+                    faces[key] = make_layer(self.draw_face, *key)
+                frame = bases[bob].copy()
+                blit_layer(frame, faces[key], offset)
+                blit_layer(frame, over, offset)
+                composed[key, bob] = frame
+            sequence.append(composed[key, bob])
+        return sequence
+
+
+class AvatarPrefetcher:
+    """Keeps a bounded buffer of ready-rendered random avatars
     
-    def generate(self, surface):
-        """Generate a complete random avatar"""
-        # Random colors
-        skin_color = random.choice(self.skin_colors)
-        hair_color = random.choice(self.hair_colors)
-        cloth_color = random.choice(self.cloth_colors)
-        bg_type = random.choice(self.backgrounds)
-        
-        # Draw in correct layer order
-        self.draw_background(surface, bg_type)
-        self.draw_body(surface, cloth_color)
-        self.draw_neck(surface, skin_color)
-        self.draw_head(surface, skin_color)
-        self.draw_face(surface)
-        self.draw_hair(surface, hair_color)
-        self.draw_hat(surface)
-        self.draw_accessory(surface)
+    A background thread renders avatars (with their traits) until the buffer
+    is full and then blocks, so taking one is instant and the buffer refills
+    while the app is idle.
+    """
+    
+    def __init__(self, generator, size=PREFETCH_SIZE):
+        self.generator = generator
+        self.ready = queue.Queue(maxsize=size)
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._fill, daemon=True)
+    
+    def start(self):
+        self.thread.start()
+        return self
+    
+    def render(self):
+        """Render one random avatar; returns (traits, surface)"""
+        surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+        traits = self.generator.generate(surface)
+        return traits, surface
+    
+    def _fill(self):
+        while not self.stopping.is_set():
+            self.ready.put(self.render())  # Blocks while the buffer is full
+    
+    def pop(self):
+        """Take a ready avatar, rendering one on the spot if the buffer is empty"""
+        try:
+            return self.ready.get_nowait()
+        except queue.Empty:
+            return self.render()
+    
+    def stop(self):
+        self.stopping.set()
+        try:
+            self.ready.get_nowait()  # Unblock a pending put
+        except queue.Empty:
+            pass
+        self.thread.join(timeout=1)
 
 
 def save_avatar(surface):
@@ -314,6 +574,43 @@ def save_avatar(surface):
     return filename
 
 
+def save_animation(frames):
+    """Save frames as a horizontal PNG strip and an animated GIF"""
+    from PIL import Image
+    
+    output_dir = Path("output")
+    output_dir.mkdir(exist_ok=True)
+    
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    strip_file = output_dir / f"avatar_anim_{timestamp}.png"
+    gif_file = output_dir / f"avatar_anim_{timestamp}.gif"
+    
+    width, height = frames[0].get_size()
+    strip = pygame.Surface((width * len(frames), height))
+    for i, frame in enumerate(frames):
+        strip.blit(frame, (i * width, 0))
+    pygame.image.save(strip, str(strip_file))
+    
+    images = [Image.frombytes("RGB", (width, height), pygame.image.tobytes(frame, "RGB")) for frame in frames]
+    images[0].save(gif_file, save_all=True, append_images=images[1:], duration=FRAME_MS, loop=0)
+    print(f"✅ Animation saved: {strip_file} and {gif_file}")
+    return strip_file, gif_file
+
+
+def save_color_variants(generator, traits):
+    """Save every colour variant of one avatar as palettized PNGs in a new folder"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_dir = Path("output") / f"avatar_colors_{timestamp}"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    
+    count = 0
+    for (skin, hair, cloth), surface in generator.color_variants(traits):
+        pygame.image.save(surface, str(output_dir / f"skin{skin}_hair{hair}_cloth{cloth}.png"))
+        count += 1
+    print(f"✅ {count} colour variants saved: {output_dir}")
+    return output_dir
+
+
 def main():
     """Main game loop"""
     pygame.init()
@@ -322,74 +619,130 @@ def main():
     screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
     pygame.display.set_caption("Fantasy Avatar Generator")
     
-    # Create generator
+    # Create generator and start rendering avatars ahead of time
     generator = AvatarGenerator()
+    prefetcher = AvatarPrefetcher(generator).start()
     
-    # Generate initial avatar
-    avatar_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
-    generator.generate(avatar_surface)
+    # Current avatar, and the ones shown before it
+    traits, avatar_surface = prefetcher.pop()
+    avatar_bytes = avatar_surface.get_bytesize() * SCREEN_WIDTH * SCREEN_HEIGHT
+    history = deque(maxlen=max(1, HISTORY_MAX_BYTES // avatar_bytes))
+    animation = None  # frames of the current avatar while animating
     
-    # Font for instructions
+    # Instructions overlay, built once and shown for the first few seconds
     pygame.font.init()
     font = pygame.font.Font(None, 24)
+    overlay = pygame.Surface((SCREEN_WIDTH, 80))
+    overlay.set_alpha(200)
+    overlay.fill((0, 0, 0))
+    instruction_lines = [
+        font.render("Click or press R to generate new avatar", True, (255, 255, 255)),
+        font.render("Backspace to go back | A to animate | S to save | ESC to quit", True, (255, 255, 255)),
+    ]
+    instructions_until = pygame.time.get_ticks() + INSTRUCTIONS_MS
     
-    # Main loop
-    running = True
-    show_instructions = True
-    instruction_timer = pygame.time.get_ticks()
+    # Only wake up for events that change what is shown
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed(
+        [pygame.QUIT, pygame.MOUSEBUTTONDOWN, pygame.KEYDOWN, pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE]
+    )
     
     print("🎨 Fantasy Avatar Generator")
     print("Controls:")
     print("  - Click or press R: Generate new avatar")
-    print("  - Press S: Save avatar")
+    print("  - Press Backspace: Back to the previous avatar")
+    print("  - Press A: Play/stop idle animation")
+    print("  - Press S: Save avatar (strip + GIF while animating)")
+    print("  - Press C: Save all colour variants")
     print("  - Press ESC: Quit")
     
+    # Main loop: redraw only when something changed, sleep in between
+    running = True
+    needs_redraw = True
+    shown_frame = None
     while running:
-        for event in pygame.event.get():
+        now = pygame.time.get_ticks()
+        if instructions_until and now >= instructions_until:
+            instructions_until = None
+            needs_redraw = True
+        if animation and now // FRAME_MS % len(animation) != shown_frame:
+            needs_redraw = True
+        
+        if needs_redraw:
+            # Draw avatar
+            if animation:
+                shown_frame = now // FRAME_MS % len(animation)
+                screen.blit(animation[shown_frame], (0, 0))
+            else:
+                screen.blit(avatar_surface, (0, 0))
+            
+            if instructions_until:
+                screen.blit(overlay, (0, SCREEN_HEIGHT - 80))
+                screen.blit(instruction_lines[0], (20, SCREEN_HEIGHT - 70))
+                screen.blit(instruction_lines[1], (20, SCREEN_HEIGHT - 45))
+            
+            pygame.display.flip()
+            needs_redraw = False
+        
+        # Sleep until the next event, or the next timed change if one is due
+        wakeups = []
+        if instructions_until:
+            wakeups.append(instructions_until)
+        if animation:
+            wakeups.append((now // FRAME_MS + 1) * FRAME_MS)
+        if wakeups:
+            first_event = pygame.event.wait(max(1, min(wakeups) - pygame.time.get_ticks()))
+        else:
+            first_event = pygame.event.wait()
+        
+        for event in [first_event] + pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
             
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                # Generate new avatar on click
-                generator.generate(avatar_surface)
+            elif event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE):
+                needs_redraw = True
+            
+            elif event.type == pygame.MOUSEBUTTONDOWN or (
+                event.type == pygame.KEYDOWN and event.key == pygame.K_r
+            ):
+                # New avatar on click or R key, taken from the prefetch buffer
+                history.append((traits, avatar_surface))
+                traits, avatar_surface = prefetcher.pop()
+                if animation:
+                    animation = generator.animate(traits)
+                needs_redraw = True
                 print("🎲 New avatar generated!")
             
             elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_r:
-                    # Generate new avatar on R key
-                    generator.generate(avatar_surface)
-                    print("🎲 New avatar generated!")
+                if event.key == pygame.K_BACKSPACE:
+                    # Back to the previous avatar
+                    if history:
+                        traits, avatar_surface = history.pop()
+                        if animation:
+                            animation = generator.animate(traits)
+                        needs_redraw = True
+                
+                elif event.key == pygame.K_a:
+                    # Toggle the idle animation on A key
+                    animation = None if animation else generator.animate(traits)
+                    shown_frame = None
+                    needs_redraw = True
                 
                 elif event.key == pygame.K_s:
                     # Save avatar on S key
-                    save_avatar(avatar_surface)
+                    if animation:
+                        save_animation(animation)
+                    else:
+                        save_avatar(avatar_surface)
+                
+                elif event.key == pygame.K_c:
+                    # Save every colour variant of the avatar on C key
+                    save_color_variants(generator, traits)
                 
                 elif event.key == pygame.K_ESCAPE:
                     running = False
-        
-        # Draw avatar
-        screen.blit(avatar_surface, (0, 0))
-        
-        # Show instructions for first 5 seconds
-        if show_instructions:
-            elapsed = pygame.time.get_ticks() - instruction_timer
-            if elapsed < 5000:
-                # Semi-transparent overlay
-                overlay = pygame.Surface((SCREEN_WIDTH, 80))
-                overlay.set_alpha(200)
-                overlay.fill((0, 0, 0))
-                screen.blit(overlay, (0, SCREEN_HEIGHT - 80))
-                
-                # Instructions text
-                text1 = font.render("Click or press R to generate new avatar", True, (255, 255, 255))
-                text2 = font.render("Press S to save | ESC to quit", True, (255, 255, 255))
-                screen.blit(text1, (20, SCREEN_HEIGHT - 70))
-                screen.blit(text2, (20, SCREEN_HEIGHT - 45))
-            else:
-                show_instructions = False
-        
-        pygame.display.flip()
     
+    prefetcher.stop()
     pygame.quit()
 
 
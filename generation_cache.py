@@ -0,0 +1,134 @@
+"""
+Content-Addressed Generation Cache
+Stores generated images on disk keyed by a hash of every input that affects
+the pixels, so re-requesting the same character returns without running the
+pipeline. Least recently used entries are evicted once the cache grows past
+its size limit.
+
+Several processes (pool workers, the daemon, a batch run) may share one
+cache directory. The files themselves are the shared state: lookups fall
+back to the disk when a key is not in this process's index, writes go
+through a unique temporary file, and eviction works from a fresh scan of the
+directory, so the size limit holds for all processes together.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+# Default cache location and size bound
+CACHE_DIR = Path("cache") / "generations"
+CACHE_MAX_BYTES = 2 * 1024**3  # 2 GB
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's contents (used to identify LoRA weights)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_cache_key(**params):
+    """Stable key for a set of generation parameters"""
+    payload = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """Disk-backed, size-bounded LRU cache of generated images"""
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> size in bytes, oldest first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._scan()
+
+    def _path(self, key):
+        return self.root / key[:2] / f"{key}.png"
+
+    def _scan(self):
+        """Rebuild the LRU order from file modification times on disk
+
+        get() touches a file on every hit, so its mtime is its last use, in
+        this process or any other sharing the directory.
+        """
+        self.entries.clear()
+        self.total_bytes = 0
+        if not self.root.exists():
+            return
+        files = []
+        for path in self.root.glob("*/*.png"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # evicted by another process meanwhile
+            files.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.total_bytes += size
+
+    def get(self, key):
+        """Return the cached image for key, or None"""
+        with self.lock:
+            # The file is checked even when the index has no entry for it, since
+            # another process may have written it
+            path = self._path(key)
+            try:
+                image = Image.open(path)
+                image.load()
+                os.utime(path)  # persist recency for the next run and other processes
+                size = path.stat().st_size
+            except OSError:
+                # Never written, evicted elsewhere or corrupt; forget it
+                self.total_bytes -= self.entries.pop(key, 0)
+                self.misses += 1
+                return None
+            self.total_bytes -= self.entries.pop(key, 0)
+            self.entries[key] = size
+            self.total_bytes += size
+            self.hits += 1
+            return image
+
+    def put(self, key, image, metadata=None):
+        """Store image under key and evict old entries past the size limit"""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        info = PngInfo()
+        if metadata:
+            info.add_text("parameters", json.dumps(metadata, sort_keys=True, default=str))
+        # A name of its own, so processes writing the same key never share a file
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=path.parent)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                image.save(f, format="PNG", pnginfo=info)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        # Other processes add files too, so evict against what is on disk now
+        self._scan()
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                self._path(key).unlink()
+            except FileNotFoundError:
+                pass
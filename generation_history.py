@@ -0,0 +1,132 @@
+"""
+Generation History
+Keeps every character generated in the UI. A SQLite index holds the prompt,
+seed, parameters and timings of each entry; the full image and a small
+thumbnail are written next to it as PNG files. The gallery only ever reads
+the thumbnails it is showing, and a past entry is restored by loading its
+image from disk, so nothing is regenerated and memory does not grow with the
+length of the history.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from PIL import Image
+
+# Default history location
+HISTORY_DIR = Path("history")
+HISTORY_DB = "history.sqlite3"
+
+# Thumbnail edge in pixels
+THUMB_SIZE = 80
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    prompt TEXT NOT NULL,
+    seed INTEGER,
+    kind TEXT NOT NULL,
+    parameters TEXT NOT NULL,
+    timings TEXT NOT NULL,
+    cache_key TEXT,
+    image TEXT NOT NULL,
+    thumbnail TEXT NOT NULL
+)
+"""
+
+
+class HistoryEntry:
+    """One row of the history index"""
+
+    def __init__(self, id, created, prompt, seed, kind, parameters, timings, cache_key, image, thumbnail):
+        self.id = id
+        self.created = created
+        self.prompt = prompt
+        self.seed = seed
+        self.kind = kind
+        self.parameters = json.loads(parameters)
+        self.timings = json.loads(timings)
+        self.cache_key = cache_key
+        self.image = image
+        self.thumbnail = thumbnail
+
+
+class GenerationHistory:
+    """SQLite-indexed store of generated images and their thumbnails"""
+
+    def __init__(self, root=HISTORY_DIR):
+        self.root = Path(root)
+        (self.root / "images").mkdir(parents=True, exist_ok=True)
+        (self.root / "thumbs").mkdir(exist_ok=True)
+        # Written from generation threads, read from the UI thread
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.root / HISTORY_DB, check_same_thread=False)
+        self.db.execute(SCHEMA)
+        self.db.commit()
+
+    def add(self, image, prompt, seed=None, kind="avatar", parameters=None, timings=None):
+        """Store a generated image; returns its entry id"""
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT INTO entries (created, prompt, seed, kind, parameters, timings, cache_key, image, thumbnail)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, '', '')",
+                (
+                    time.time(),
+                    prompt,
+                    seed,
+                    kind,
+                    json.dumps(parameters or {}, sort_keys=True, default=str),
+                    json.dumps(timings or {}, sort_keys=True, default=str),
+                    image.info.get("cache_key"),
+                ),
+            )
+            entry_id = cursor.lastrowid
+            self.db.commit()
+
+        # Files are written outside the lock so the gallery never waits on PNG encoding;
+        # until the row points at them the entry stays hidden
+        image_name = f"images/{entry_id:06d}.png"
+        thumb_name = f"thumbs/{entry_id:06d}.png"
+        image.save(self.root / image_name, format="PNG")
+        thumbnail = image.convert("RGB").resize((THUMB_SIZE, THUMB_SIZE), Image.BOX)
+        thumbnail.save(self.root / thumb_name, format="PNG")
+        with self.lock:
+            self.db.execute(
+                "UPDATE entries SET image = ?, thumbnail = ? WHERE id = ?", (image_name, thumb_name, entry_id)
+            )
+            self.db.commit()
+        return entry_id
+
+    def count(self):
+        """Number of stored entries"""
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM entries WHERE image != ''").fetchone()[0]
+
+    def page(self, offset, limit):
+        """Entries newest first, skipping the first offset"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM entries WHERE image != '' ORDER BY id DESC LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        return [HistoryEntry(*row) for row in rows]
+
+    def thumbnail_path(self, entry):
+        """Where an entry's THUMB_SIZE thumbnail is stored"""
+        return self.root / entry.thumbnail
+
+    def load_image(self, entry):
+        """Full-size image of an entry, tagged so variations can reuse cached latents"""
+        image = Image.open(self.root / entry.image)
+        image.load()
+        if entry.cache_key:
+            image.info["cache_key"] = entry.cache_key
+        return image
+
+    def close(self):
+        """Close the index"""
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,234 @@
+"""
+Generation Metrics
+Per-stage timing, throughput and memory figures for AIAvatarGenerator.
+Each finished job is emitted as one structured JSON log line (and optionally
+appended to a JSONL file); running totals can be scraped in Prometheus text
+format from a small HTTP endpoint.
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+logger = logging.getLogger("ai_avatar_generator.metrics")
+
+
+def rss_bytes():
+    """Current resident set size of this process, or None if unknown"""
+    if sys.platform == "win32":
+        counters = _windows_memory_counters()
+        return counters.WorkingSetSize if counters else None
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    """Highest resident set size this process has reached, or None if unknown"""
+    if sys.platform == "win32":
+        counters = _windows_memory_counters()
+        return counters.PeakWorkingSetSize if counters else None
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _windows_memory_counters():
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    handle = ctypes.windll.kernel32.GetCurrentProcess()
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+        return None
+    return counters
+
+
+class GenerationJob:
+    """Timings collected for a single generation"""
+
+    def __init__(self, queued_at=None):
+        self.started_at = time.perf_counter()
+        self.queue_wait = self.started_at - queued_at if queued_at is not None else 0.0
+        self.stages = defaultdict(float)
+        self.step_durations = []
+        self.fields = {}
+        self._last_step_at = None
+
+    def start_steps(self):
+        """Mark the start of the denoising loop"""
+        self._last_step_at = time.perf_counter()
+
+    def mark_step(self):
+        """Record the duration of the denoising step that just finished"""
+        now = time.perf_counter()
+        if self._last_step_at is not None:
+            self.step_durations.append(now - self._last_step_at)
+        self._last_step_at = now
+
+
+class GenerationMetrics:
+    """Aggregates job metrics and exports them as JSON logs or Prometheus text"""
+
+    def __init__(self, log_path=None):
+        self.log_path = Path(log_path) if log_path else None
+        self.lock = threading.Lock()
+        self.stage_seconds = defaultdict(float)
+        self.stage_counts = defaultdict(int)
+        self.jobs_completed = 0
+        self.jobs_cached = 0
+        self.jobs_failed = 0
+        self.generation_seconds = 0.0
+        self.queue_wait_seconds = 0.0
+        self.peak_vram_bytes = 0
+        self.last_record = None
+        self.server = None
+
+    def start_job(self, queued_at=None):
+        """Begin timing a generation; queued_at is a time.perf_counter() value"""
+        return GenerationJob(queued_at)
+
+    @contextmanager
+    def stage(self, name, job=None):
+        """Time a stage, attributing it to job when given"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if job is not None:
+                job.stages[name] += elapsed
+            with self.lock:
+                self.stage_seconds[name] += elapsed
+                self.stage_counts[name] += 1
+
+    def finish_job(self, job, success=True, **fields):
+        """Close a job, fold it into the totals and emit its JSON record"""
+        total = time.perf_counter() - job.started_at
+        job.fields.update(fields)
+        record = {
+            "event": "generation",
+            "timestamp": time.time(),
+            "success": success,
+            "queue_wait_s": round(job.queue_wait, 4),
+            "total_s": round(total, 4),
+            "images_per_s": round(1.0 / total, 4) if success and total > 0 else 0.0,
+            "stages_s": {name: round(seconds, 4) for name, seconds in job.stages.items()},
+            "step_s": [round(seconds, 4) for seconds in job.step_durations],
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+        record.update(job.fields)
+
+        with self.lock:
+            if success:
+                self.jobs_completed += 1
+                self.generation_seconds += total
+                if job.fields.get("cached"):
+                    self.jobs_cached += 1
+            else:
+                self.jobs_failed += 1
+            self.queue_wait_seconds += job.queue_wait
+            self.peak_vram_bytes = max(self.peak_vram_bytes, job.fields.get("peak_vram_bytes") or 0)
+            self.last_record = record
+
+        line = json.dumps(record, sort_keys=True, default=str)
+        logger.info(line)
+        if self.log_path:
+            with self.lock, open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        return record
+
+    def images_per_second(self):
+        """Lifetime throughput over time spent generating"""
+        with self.lock:
+            if self.generation_seconds <= 0:
+                return 0.0
+            return self.jobs_completed / self.generation_seconds
+
+    def prometheus_text(self):
+        """Current totals in the Prometheus text exposition format"""
+        rate = self.images_per_second()
+        with self.lock:
+            lines = [
+                "# HELP avatar_generations_total Finished generation jobs.",
+                "# TYPE avatar_generations_total counter",
+                f'avatar_generations_total{{result="generated"}} {self.jobs_completed - self.jobs_cached}',
+                f'avatar_generations_total{{result="cached"}} {self.jobs_cached}',
+                f'avatar_generations_total{{result="failed"}} {self.jobs_failed}',
+                "# HELP avatar_stage_seconds Time spent in each generation stage.",
+                "# TYPE avatar_stage_seconds summary",
+            ]
+            for name in sorted(self.stage_seconds):
+                lines.append(f'avatar_stage_seconds_sum{{stage="{name}"}} {self.stage_seconds[name]:.6f}')
+                lines.append(f'avatar_stage_seconds_count{{stage="{name}"}} {self.stage_counts[name]}')
+            lines += [
+                "# HELP avatar_queue_wait_seconds_total Time jobs spent waiting before generation started.",
+                "# TYPE avatar_queue_wait_seconds_total counter",
+                f"avatar_queue_wait_seconds_total {self.queue_wait_seconds:.6f}",
+                "# HELP avatar_images_per_second Images produced per second of generation time.",
+                "# TYPE avatar_images_per_second gauge",
+                f"avatar_images_per_second {rate:.6f}",
+                "# HELP avatar_peak_vram_bytes Highest VRAM allocation seen during a job.",
+                "# TYPE avatar_peak_vram_bytes gauge",
+                f"avatar_peak_vram_bytes {self.peak_vram_bytes}",
+            ]
+        peak_rss = peak_rss_bytes()
+        if peak_rss is not None:
+            lines += [
+                "# HELP avatar_peak_rss_bytes Highest resident set size of the process.",
+                "# TYPE avatar_peak_rss_bytes gauge",
+                f"avatar_peak_rss_bytes {peak_rss}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    def serve_prometheus(self, port, host="127.0.0.1"):
+        """Expose prometheus_text() at http://host:port/metrics from a background thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"📈 Metrics available at http://{host}:{port}/metrics")
+        return self.server
@@ -0,0 +1,123 @@
+"""
+LoRA Registry
+Named LoRA styles that can be swapped, stacked and weighted per request
+while the SDXL base model stays resident. Adapters are injected into the
+pipeline once and then switched with set_adapters; the least recently used
+ones are unloaded when more than max_loaded are resident.
+
+Styles can be listed in a JSON file:
+    {
+        "pixel-art": {"path": "pixel-art-xl-v1.1.safetensors", "weight": 1.0},
+        "dark-fantasy": {"path": "loras/dark-fantasy.safetensors", "weight": 0.7}
+    }
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from generation_cache import hash_file
+
+# Optional style list picked up from the working directory
+LORA_CONFIG = Path("loras.json")
+
+# Adapters kept injected in the pipeline at once
+MAX_LOADED_ADAPTERS = 4
+
+
+class LoraRegistry:
+    """Keeps track of LoRA styles and which of them are loaded into a pipeline"""
+
+    def __init__(self, max_loaded=MAX_LOADED_ADAPTERS):
+        self.max_loaded = max_loaded
+        self.styles = {}  # name -> (path, default weight)
+        self.hashes = {}  # name -> sha256 of the weights file
+        self.loaded = OrderedDict()  # adapter names resident in the pipeline, oldest first
+        self.active = None
+        self.lock = threading.Lock()
+
+    def register(self, name, path, weight=1.0):
+        """Add (or replace) a named style"""
+        path = Path(path)
+        if name in self.styles and self.styles[name][0] != path:
+            self.hashes.pop(name, None)
+        self.styles[name] = (path, float(weight))
+
+    def load_config(self, config_path=LORA_CONFIG):
+        """Register every style listed in a JSON config file, if it exists"""
+        config_path = Path(config_path)
+        if not config_path.exists():
+            return
+        with open(config_path, encoding="utf-8") as f:
+            for name, entry in json.load(f).items():
+                self.register(name, entry["path"], entry.get("weight", 1.0))
+        print(f"🎨 LoRA styles: {', '.join(sorted(self.styles))}")
+
+    def available(self):
+        """Names of registered styles whose weights file exists"""
+        return [name for name, (path, _) in self.styles.items() if path.exists()]
+
+    def resolve(self, loras):
+        """Normalize a request to a sorted tuple of (name, weight)
+
+        loras may be a style name, a list of names, or a {name: weight} dict;
+        names without a weight use the style's default weight.
+        """
+        if isinstance(loras, str):
+            loras = [loras]
+        if not isinstance(loras, dict):
+            loras = {name: None for name in loras}
+        resolved = []
+        for name, weight in loras.items():
+            if name not in self.styles:
+                raise KeyError(f"Unknown LoRA style: {name}")
+            resolved.append((name, self.styles[name][1] if weight is None else float(weight)))
+        return tuple(sorted(resolved))
+
+    def describe(self, resolved):
+        """Content identity of a resolved request (file hashes and weights)"""
+        description = []
+        for name, weight in resolved:
+            if name not in self.hashes:
+                self.hashes[name] = hash_file(self.styles[name][0])
+            description.append([self.hashes[name], weight])
+        return description
+
+    def activate(self, pipeline, resolved):
+        """Make exactly the resolved adapters active on pipeline, loading as needed"""
+        with self.lock:
+            if resolved == self.active:
+                return
+            if not resolved:
+                if self.loaded:
+                    pipeline.disable_lora()
+                self.active = resolved
+                return
+
+            for name, _ in resolved:
+                if name in self.loaded:
+                    self.loaded.move_to_end(name)
+                    continue
+                path = self.styles[name][0]
+                print(f"🎨 Loading LoRA style '{name}': {path}")
+                pipeline.load_lora_weights(
+                    str(path.parent), weight_name=path.name, adapter_name=name
+                )
+                self.loaded[name] = True
+
+            # Unload least recently used adapters that are not needed right now
+            wanted = {name for name, _ in resolved}
+            for name in list(self.loaded):
+                if len(self.loaded) <= self.max_loaded:
+                    break
+                if name not in wanted:
+                    pipeline.delete_adapters(name)
+                    del self.loaded[name]
+
+            pipeline.enable_lora()
+            pipeline.set_adapters(
+                [name for name, _ in resolved],
+                adapter_weights=[weight for _, weight in resolved],
+            )
+            self.active = resolved
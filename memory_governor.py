@@ -0,0 +1,85 @@
+"""
+Memory Governance
+Keeps a long-running generator process at a steady footprint. After every
+job the request's tensors are dropped, reference cycles are collected
+periodically and freed heap pages are handed back to the OS (glibc keeps
+them otherwise, which shows up as slow RSS growth over days). Initial noise
+is drawn into buffers reused across jobs of the same shape, and each job's
+metrics record gets the RSS and VRAM watermarks it finished at.
+"""
+
+import ctypes
+import ctypes.util
+import gc
+import sys
+import threading
+from collections import OrderedDict
+
+import torch
+
+from generation_metrics import rss_bytes
+
+# Full garbage collection every N jobs (cycles left by tracebacks and callbacks)
+GC_INTERVAL = 10
+
+# Latent shapes whose noise buffers are kept
+NOISE_BUFFERS = 4
+
+
+def _load_malloc_trim():
+    """glibc's malloc_trim, or None where it does not exist (macOS, Windows, musl)"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        return ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6").malloc_trim
+    except (OSError, AttributeError):
+        return None
+
+
+class MemoryGovernor:
+    """Per-job memory housekeeping for AIAvatarGenerator"""
+
+    def __init__(self, device, gc_interval=GC_INTERVAL):
+        self.device = device
+        self.gc_interval = gc_interval
+        self.jobs = 0
+        self.noise_buffers = OrderedDict()  # (shape, dtype) -> tensor, least recently used first
+        self.malloc_trim = _load_malloc_trim()
+        self.lock = threading.Lock()
+
+    def noise(self, shape, dtype, generator):
+        """Initial latents drawn from generator into a buffer reused for this shape
+
+        Gives exactly the values the pipeline would draw itself, so images do
+        not change. The pipeline scales the noise into a new tensor before
+        the first step, so the buffer is free again once denoising starts.
+        """
+        key = (tuple(shape), dtype)
+        with self.lock:
+            buffer = self.noise_buffers.pop(key, None)
+            if buffer is None:
+                buffer = torch.empty(shape, dtype=dtype)
+            self.noise_buffers[key] = buffer
+            while len(self.noise_buffers) > NOISE_BUFFERS:
+                self.noise_buffers.popitem(last=False)
+        return torch.randn(shape, generator=generator, dtype=dtype, out=buffer)
+
+    def release(self, request):
+        """Drop a finished request's tensors and give freed memory back"""
+        request.latents = None
+        request.init = None
+        with self.lock:
+            self.jobs += 1
+            collect = self.jobs % self.gc_interval == 0
+        if collect:
+            gc.collect()
+        if self.malloc_trim is not None:
+            self.malloc_trim(0)
+
+    def watermarks(self):
+        """Current process memory, for the job's metrics record"""
+        marks = {"rss_bytes": rss_bytes()}
+        if self.device == "cuda":
+            marks["vram_allocated_bytes"] = torch.cuda.memory_allocated()
+            marks["vram_reserved_bytes"] = torch.cuda.memory_reserved()
+        return marks
@@ -0,0 +1,103 @@
+"""
+Memory-Mapped SDXL Weights
+Builds a StableDiffusionXLPipeline whose model parameters are zero-copy
+views of the on-disk safetensors files. Pages are mapped copy-on-write and
+never written during inference, so every process that loads the same model
+this way shares one copy of the weights through the OS page cache instead
+of holding its own.
+
+CPU only: on CUDA the weights are copied into VRAM anyway.
+"""
+
+import json
+import mmap
+import struct
+from pathlib import Path
+
+import torch
+from accelerate import init_empty_weights
+from diffusers import AutoencoderKL, StableDiffusionXLPipeline, UNet2DConditionModel
+from transformers import AutoConfig, CLIPTextModel, CLIPTextModelWithProjection
+
+# safetensors dtype codes
+DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def mmap_safetensors(path):
+    """Return {name: tensor} backed directly by a copy-on-write mapping of path"""
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    (header_size,) = struct.unpack("<Q", mapped[:8])
+    header = json.loads(mapped[8 : 8 + header_size])
+    header.pop("__metadata__", None)
+
+    tensors = {}
+    data_start = 8 + header_size
+    for name, info in header.items():
+        dtype = DTYPES[info["dtype"]]
+        start, end = info["data_offsets"]
+        count = (end - start) // torch.empty((), dtype=dtype).element_size()
+        if count == 0:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        tensor = torch.frombuffer(mapped, dtype=dtype, count=count, offset=data_start + start)
+        tensors[name] = tensor.view(info["shape"])
+    return tensors
+
+
+def _component_files(folder):
+    """Full-precision safetensors shards of one pipeline component"""
+    files = sorted(
+        path
+        for path in Path(folder).glob("*.safetensors")
+        # Skip variants such as diffusion_pytorch_model.fp16.safetensors
+        if len(path.name.split(".")) == 2
+    )
+    if not files:
+        raise FileNotFoundError(f"No full-precision safetensors weights in {folder}")
+    return files
+
+
+def _assign_weights(model, folder):
+    """Point model's parameters at the memory-mapped weights in folder"""
+    state = {}
+    for path in _component_files(folder):
+        state.update(mmap_safetensors(path))
+    model.load_state_dict(state, strict=False, assign=True)
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if missing:
+        raise ValueError(f"Weights in {folder} do not cover {len(missing)} parameters, e.g. {missing[0]}")
+    return model.eval()
+
+
+def load_mmap_pipeline(model_id):
+    """Build an SDXL pipeline on CPU with memory-mapped float32 weights"""
+    root = Path(model_id)
+    if not root.is_dir():
+        root = Path(StableDiffusionXLPipeline.download(model_id, use_safetensors=True))
+
+    with init_empty_weights():
+        unet = UNet2DConditionModel.from_config(UNet2DConditionModel.load_config(root / "unet"))
+        vae = AutoencoderKL.from_config(AutoencoderKL.load_config(root / "vae"))
+        text_encoder = CLIPTextModel(AutoConfig.from_pretrained(root / "text_encoder"))
+        text_encoder_2 = CLIPTextModelWithProjection(AutoConfig.from_pretrained(root / "text_encoder_2"))
+
+    # Tokenizers and the scheduler are small and load normally
+    return StableDiffusionXLPipeline.from_pretrained(
+        str(root),
+        unet=_assign_weights(unet, root / "unet"),
+        vae=_assign_weights(vae, root / "vae"),
+        text_encoder=_assign_weights(text_encoder, root / "text_encoder"),
+        text_encoder_2=_assign_weights(text_encoder_2, root / "text_encoder_2"),
+    )
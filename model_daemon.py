@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Resident Model Daemon
+Keeps a loaded Stable Diffusion XL pipeline in memory across UI restarts.
+The UI connects over a local socket and uses DaemonClient as a drop-in
+replacement for AIAvatarGenerator.
+
+Usage:
+    python model_daemon.py          # start the daemon (loads the model immediately)
+    python model_daemon.py --stop   # ask a running daemon to shut down
+"""
+
+import argparse
+import logging
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+
+from generation_metrics import GenerationMetrics
+
+# Local address the daemon listens on
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = 50517
+DAEMON_ADDRESS = (DAEMON_HOST, DAEMON_PORT)
+
+# Per-user secret shared by the daemon and its clients
+AUTHKEY_FILE = Path.home() / ".pixel_avatar_daemon.key"
+AUTHKEY_BYTES = 32
+
+# How long a client waits for a freshly spawned daemon to accept connections
+DAEMON_START_TIMEOUT = 60
+
+# How often the daemon forwards progress updates while generating (seconds)
+PROGRESS_INTERVAL = 0.2
+
+
+def load_authkey():
+    """Read the shared daemon key, creating it on first use
+
+    The key is the only thing guarding a channel that unpickles what it
+    receives, so the file is created owner-only in one step and a key file
+    other users can read is refused.
+    """
+    try:
+        fd = os.open(AUTHKEY_FILE, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, "wb") as f:
+            f.write(secrets.token_bytes(AUTHKEY_BYTES))
+
+    if sys.platform != "win32" and AUTHKEY_FILE.stat().st_mode & 0o077:
+        raise PermissionError(f"{AUTHKEY_FILE} is accessible to other users; delete it or run: chmod 600 {AUTHKEY_FILE}")
+    # Another process may have just created the file and not written the key yet
+    deadline = time.monotonic() + 1
+    while True:
+        key = AUTHKEY_FILE.read_bytes()
+        if len(key) >= AUTHKEY_BYTES or time.monotonic() > deadline:
+            break
+        time.sleep(0.01)
+    if len(key) < AUTHKEY_BYTES:
+        raise PermissionError(f"{AUTHKEY_FILE} does not hold a valid key; delete it to create a new one")
+    return key
+
+
+def spawn_daemon(metrics_log=None, metrics_port=None, tiny_vae=None):
+    """Start the daemon as a detached background process with the given options"""
+    command = [sys.executable, str(Path(__file__).resolve())]
+    if metrics_log:
+        command += ["--metrics-log", str(Path(metrics_log).resolve())]
+    if metrics_port:
+        command += ["--metrics-port", str(metrics_port)]
+    if tiny_vae:
+        command += ["--tiny-vae", str(Path(tiny_vae).resolve())]
+    if sys.platform == "win32":
+        flags = subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.DETACHED_PROCESS
+        subprocess.Popen(command, creationflags=flags, close_fds=True)
+    else:
+        subprocess.Popen(
+            command,
+            start_new_session=True,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    print("🚀 Started resident model daemon")
+
+
+class DaemonClient:
+    """Stand-in for AIAvatarGenerator that forwards work to the model daemon"""
+
+    def __init__(self, address=DAEMON_ADDRESS, spawn=True, metrics=None, daemon_options=None):
+        self.address = address
+        self.spawn = spawn
+        # spawn_daemon options; a daemon that is already running keeps its own
+        self.daemon_options = daemon_options or {}
+        # Generation metrics live in the daemon; this only times UI-side stages
+        self.metrics = metrics or GenerationMetrics()
+        self.conn = None
+        self.lock = threading.Lock()
+        self.device = "daemon"
+        self.is_loading = False
+        self.is_generating = False
+        self.model_loaded = False
+        self.progress = 0
+        self.progress_text = ""
+
+    def connect(self):
+        """Connect to the daemon, spawning it first if it is not running"""
+        if self.conn is not None:
+            return
+        authkey = load_authkey()
+        try:
+            self.conn = Client(self.address, authkey=authkey)
+            return
+        except OSError:
+            if not self.spawn:
+                raise
+        spawn_daemon(**self.daemon_options)
+        deadline = time.monotonic() + DAEMON_START_TIMEOUT
+        while True:
+            try:
+                self.conn = Client(self.address, authkey=authkey)
+                print(f"🔌 Connected to model daemon at {self.address[0]}:{self.address[1]}")
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.5)
+
+    def _request(self, *message):
+        """Send one command and return the daemon's final reply"""
+        self.conn.send(message)
+        while True:
+            reply = self.conn.recv()
+            if reply[0] == "progress":
+                _, self.progress, self.progress_text = reply
+            else:
+                return reply[1]
+
+    def load_model(self):
+        """Ask the daemon to load the model (instant if it is already resident)"""
+        if self.model_loaded:
+            return
+
+        self.is_loading = True
+        try:
+            with self.lock:
+                self.connect()
+                self.model_loaded = bool(self._request("load"))
+        except (OSError, EOFError) as e:
+            print(f"❌ Model daemon unavailable: {e}")
+            self.conn = None
+            self.model_loaded = False
+        finally:
+            self.is_loading = False
+
+    def generate_avatar(self, prompt, negative_prompt=None, **kwargs):
+        """Generate on the daemon; progress is mirrored onto this object"""
+        return self._generate("generate_avatar", (prompt, negative_prompt), kwargs)
+
+    def generate_variation(self, image, prompt, **kwargs):
+        """Generate a variation of image on the daemon"""
+        return self._generate("generate_variation", (image, prompt), kwargs)
+
+    def generate_guided(self, prompt, **kwargs):
+        """Generate on top of a procedural avatar on the daemon"""
+        return self._generate("generate_guided", (prompt,), kwargs)
+
+    def _generate(self, method, args, kwargs):
+        if not self.model_loaded:
+            print("❌ Model not loaded yet!")
+            return None
+
+        self.is_generating = True
+        self.progress = 0
+        self.progress_text = "Starting generation..."
+        try:
+            with self.lock:
+                return self._request("generate", method, args, kwargs)
+        except (OSError, EOFError) as e:
+            print(f"❌ Lost connection to model daemon: {e}")
+            self.conn = None
+            self.model_loaded = False
+            return None
+        finally:
+            self.is_generating = False
+            self.progress = 0
+            self.progress_text = ""
+
+
+def _handle_connection(conn, generator, pipeline_lock, stop_event):
+    """Serve one client until it disconnects"""
+    try:
+        while True:
+            message = conn.recv()
+            command = message[0]
+
+            if command == "load":
+                with pipeline_lock:
+                    generator.load_model()
+                conn.send(("result", generator.model_loaded))
+
+            elif command == "generate":
+                _, method, args, kwargs = message
+                if method not in ("generate_avatar", "generate_variation", "generate_guided"):
+                    conn.send(("result", None))
+                    continue
+                # Queue wait is measured from when the daemon received the request
+                kwargs["queued_at"] = time.perf_counter()
+                result = {}
+
+                def run():
+                    result["image"] = getattr(generator, method)(*args, **kwargs)
+
+                with pipeline_lock:
+                    worker = threading.Thread(target=run, daemon=True)
+                    worker.start()
+                    last = None
+                    connected = True
+                    while worker.is_alive():
+                        worker.join(PROGRESS_INTERVAL)
+                        current = (generator.progress, generator.progress_text)
+                        if connected and current != last and generator.is_generating:
+                            try:
+                                conn.send(("progress",) + current)
+                            except (EOFError, OSError):
+                                # Keep the lock until the generation finishes; nobody else may use the pipeline
+                                connected = False
+                            last = current
+                if not connected:
+                    return
+                conn.send(("result", result.get("image")))
+
+            elif command == "stop":
+                conn.send(("result", True))
+                stop_event.set()
+                return
+
+            else:
+                conn.send(("result", None))
+    except (EOFError, OSError):
+        pass
+    finally:
+        conn.close()
+
+
+def serve(address=DAEMON_ADDRESS, metrics_log=None, metrics_port=None, tiny_vae=None):
+    """Run the daemon: load the model once, then serve clients until stopped"""
+    from ai_avatar_generator import AIAvatarGenerator
+
+    # Checked before the model loads so a bad key file fails fast
+    authkey = load_authkey()
+    generator = AIAvatarGenerator(metrics=GenerationMetrics(metrics_log), tiny_vae=tiny_vae)
+    if metrics_port:
+        generator.metrics.serve_prometheus(metrics_port)
+    pipeline_lock = threading.Lock()
+    stop_event = threading.Event()
+    listener = Listener(address, authkey=authkey)
+    print(f"🛰️  Model daemon listening on {address[0]}:{address[1]}")
+
+    def preload():
+        with pipeline_lock:
+            generator.load_model()
+
+    threading.Thread(target=preload, daemon=True).start()
+
+    def accept_loop():
+        while not stop_event.is_set():
+            try:
+                conn = listener.accept()
+            except OSError:
+                # Covers failed handshakes as well as the listener closing
+                if stop_event.is_set():
+                    return
+                continue
+            threading.Thread(
+                target=_handle_connection,
+                args=(conn, generator, pipeline_lock, stop_event),
+                daemon=True,
+            ).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    try:
+        stop_event.wait()
+    except KeyboardInterrupt:
+        pass
+    listener.close()
+    print("👋 Model daemon stopped")
+
+
+def stop_daemon(address=DAEMON_ADDRESS):
+    """Ask a running daemon to exit"""
+    authkey = load_authkey()
+    try:
+        conn = Client(address, authkey=authkey)
+    except OSError:
+        print("ℹ️  No model daemon is running")
+        return False
+    conn.send(("stop",))
+    conn.recv()
+    conn.close()
+    print("✅ Model daemon stopped")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident SDXL model daemon")
+    parser.add_argument("--stop", action="store_true", help="Stop a running daemon")
+    parser.add_argument("--metrics-log", help="Append per-generation metrics as JSON lines to this file")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus-style metrics on this local port")
+    parser.add_argument("--tiny-vae", help="Decode final images with a tiny autoencoder from this local path")
+    args = parser.parse_args()
+
+    if args.stop:
+        stop_daemon()
+    else:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+        serve(metrics_log=args.metrics_log, metrics_port=args.metrics_port, tiny_vae=args.tiny_vae)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Staged Generation Pipeline
+Runs AIAvatarGenerator requests as a two-stage pipeline. One thread prepares
+and denoises, a second decodes the latents with the VAE and converts them to
+PIL images, so the decode of job N runs while job N+1 is denoising. Bounded
+queues sit in front of each stage: submitting blocks once QUEUE_SIZE
+requests are waiting, which keeps at most a few sets of latents in memory.
+
+On CUDA the decode stage uses its own stream, ordered after the denoise that
+produced its latents by an event, so the two stages overlap on the GPU too.
+On CPU both stages share the same cores; the overlap then mostly hides the
+Python-side work (PIL conversion, caching) rather than the VAE itself.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+# Requests allowed to wait in front of each stage
+QUEUE_SIZE = 2
+
+
+class StagedGenerator:
+    """Overlaps VAE decoding with the next request's denoising"""
+
+    def __init__(self, generator, queue_size=QUEUE_SIZE):
+        self.generator = generator
+        self.requests = queue.Queue(queue_size)
+        self.decodes = queue.Queue(queue_size)
+        self.threads = []
+        self.decode_stream = None
+
+    def start(self):
+        """Load the model and start both stage threads"""
+        self.generator.load_model()
+        if not self.generator.model_loaded:
+            raise RuntimeError("Model failed to load")
+        if self.generator.device == "cuda":
+            self.decode_stream = torch.cuda.Stream()
+        for target in (self._denoise_loop, self._decode_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def submit(self, prompt, *args, **kwargs):
+        """Queue a generate_avatar call; returns a Future for the image (None on failure)"""
+        kwargs.setdefault("queued_at", time.perf_counter())
+        return self._submit(self.generator.avatar_request(prompt, *args, **kwargs))
+
+    def submit_variation(self, image, prompt, *args, **kwargs):
+        """Queue a generate_variation call; returns a Future for the image (None on failure)"""
+        kwargs.setdefault("queued_at", time.perf_counter())
+        return self._submit(self.generator.variation_request(image, prompt, *args, **kwargs))
+
+    def submit_guided(self, prompt, *args, **kwargs):
+        """Queue a generate_guided call; returns a Future for the image (None on failure)"""
+        kwargs.setdefault("queued_at", time.perf_counter())
+        return self._submit(self.generator.guided_request(prompt, *args, **kwargs))
+
+    def _submit(self, request):
+        future = Future()
+        # Blocks while the denoise stage is QUEUE_SIZE requests behind
+        self.requests.put((request, future))
+        return future
+
+    def map(self, prompts, **kwargs):
+        """Generate every prompt and return the images in order"""
+        futures = [self.submit(prompt, **kwargs) for prompt in prompts]
+        return [future.result() for future in futures]
+
+    def _denoise_loop(self):
+        generator = self.generator
+        for request, future in iter(self.requests.get, None):
+            try:
+                generator.prepare(request)
+                if request.image is None:
+                    generator.denoise(request)
+                    if self.decode_stream is not None:
+                        request.denoised = torch.cuda.Event()
+                        request.denoised.record()
+            except Exception as e:
+                self._fail(request, future, e)
+                continue
+            self.decodes.put((request, future))
+        self.decodes.put(None)
+
+    def _decode_loop(self):
+        generator = self.generator
+        for request, future in iter(self.decodes.get, None):
+            try:
+                if request.image is None:
+                    if self.decode_stream is None:
+                        generator.decode(request)
+                    else:
+                        with torch.cuda.stream(self.decode_stream):
+                            self.decode_stream.wait_event(request.denoised)
+                            # The latents were allocated on the denoise stream
+                            request.latents.record_stream(self.decode_stream)
+                            generator.decode(request)
+                    print("✅ Character generated successfully!")
+            except Exception as e:
+                self._fail(request, future, e)
+                continue
+            request.latents = None
+            generator.finish(request)
+            future.set_result(request.image)
+
+    def _fail(self, request, future, error):
+        print(f"❌ Error generating character: {error}")
+        if request.job is not None:
+            request.job.fields["error"] = str(error)
+            self.generator.finish(request)
+        future.set_result(None)
+
+    def close(self):
+        """Finish every queued request, then stop both stages"""
+        if self.threads:
+            self.requests.put(None)
+            for thread in self.threads:
+                thread.join()
+            self.threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
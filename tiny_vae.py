@@ -0,0 +1,40 @@
+"""
+Tiny VAE Decoder
+The full SDXL VAE decode is one of the most expensive single operations per
+image on CPU, and our pixel-art output is quantized and downscaled
+afterwards anyway. A tiny autoencoder (TAESDXL) decodes the same latents
+with a few small convolution blocks at a fraction of the time and memory,
+at the cost of some fine detail.
+
+Only local weights are used: either a diffusers AutoencoderTiny directory
+(config.json plus weights, e.g. a download of madebyollin/taesdxl) or a
+single safetensors file of its state dict, which is assumed to use the
+default TAESDXL configuration.
+"""
+
+from pathlib import Path
+
+import torch
+from diffusers import AutoencoderTiny
+from safetensors.torch import load_file
+
+# Default location of the tiny autoencoder weights
+TINY_VAE_PATH = Path("taesdxl")
+
+
+def tiny_scale_factor(vae):
+    """How many pixels each latent cell decodes to, per side"""
+    return vae.config.upsampling_scaling_factor ** (len(vae.config.decoder_block_out_channels) - 1)
+
+
+def load_tiny_vae(path=TINY_VAE_PATH, device="cpu", dtype=torch.float32):
+    """Load an AutoencoderTiny from a local directory or safetensors file"""
+    path = Path(path)
+    if path.is_dir():
+        vae = AutoencoderTiny.from_pretrained(path, torch_dtype=dtype)
+    else:
+        vae = AutoencoderTiny()
+        vae.load_state_dict(load_file(path))
+        if dtype != vae.dtype:
+            vae.to(dtype=dtype)
+    return vae.to(device).eval()
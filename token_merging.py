@@ -0,0 +1,146 @@
+"""
+Token Merging (ToMe) for the SDXL UNet
+Self-attention cost grows with the square of the number of spatial tokens,
+and flat regions (plain backgrounds, the display stand) produce many nearly
+identical tokens. Before each high-resolution self-attention a fraction of
+the tokens is merged into their most similar neighbours; after it the merged
+outputs are copied back to every token they stand for, so the rest of the
+block sees the full sequence again.
+
+Tokens are split into a destination set (one random token per 2x2 cell) and
+a source set; the ratio of tokens with the most similar destination are
+averaged into it (bipartite soft matching). Randomness comes from a
+generator seeded once per denoising run, so a seed still gives one image.
+
+Based on Bolya & Hoffman, "Token Merging for Fast Stable Diffusion" (2023).
+"""
+
+import math
+
+import torch
+
+# Fraction of tokens merged away before each self-attention
+TOME_RATIO = 0.5
+
+# Only merge in blocks downsampled at most this much from the latents. SDXL
+# has no attention at full latent resolution, so 2 covers its largest
+# (and most expensive) attention level
+TOME_MAX_DOWNSAMPLE = 2
+
+
+def bipartite_soft_matching(x, width, height, r, generator):
+    """Plan merging r of x's (B, N, C) tokens laid out as height x width; returns (merge, unmerge)"""
+    batch, tokens, _ = x.shape
+    cells_y, cells_x = height // 2, width // 2
+    num_dst = cells_y * cells_x
+    r = min(r, tokens - num_dst)
+    if r <= 0:
+        return None, None
+
+    with torch.no_grad():
+        # Mark one random token in each 2x2 cell as a destination (-1); tokens
+        # outside whole cells (odd sizes) are always sources
+        choice = torch.randint(4, (cells_y, cells_x, 1), generator=generator).to(x.device)
+        marks = torch.zeros(cells_y, cells_x, 4, dtype=torch.int64, device=x.device)
+        marks.scatter_(2, choice, -1)
+        marks = marks.view(cells_y, cells_x, 2, 2).transpose(1, 2).reshape(cells_y * 2, cells_x * 2)
+        if marks.shape != (height, width):
+            padded = torch.zeros(height, width, dtype=torch.int64, device=x.device)
+            padded[: cells_y * 2, : cells_x * 2] = marks
+            marks = padded
+        order = marks.reshape(1, -1, 1).argsort(dim=1)
+        dst_idx = order[:, :num_dst]
+        src_idx = order[:, num_dst:]
+
+        metric = x / x.norm(dim=-1, keepdim=True)
+        src = metric.gather(1, src_idx.expand(batch, -1, metric.shape[-1]))
+        dst = metric.gather(1, dst_idx.expand(batch, -1, metric.shape[-1]))
+        best_score, best_dst = (src @ dst.transpose(-1, -2)).max(dim=-1)
+        ranked = best_score.argsort(dim=-1, descending=True)[..., None]
+        kept = ranked[:, r:]  # sources left alone, indices into src
+        merged = ranked[:, :r]  # sources averaged into a destination
+        merged_dst = best_dst[..., None].gather(1, merged)
+
+    def merge(x):
+        channels = x.shape[-1]
+        src = x.gather(1, src_idx.expand(batch, -1, channels))
+        dst = x.gather(1, dst_idx.expand(batch, -1, channels))
+        unmerged = src.gather(1, kept.expand(-1, -1, channels))
+        moving = src.gather(1, merged.expand(-1, -1, channels))
+        dst = dst.scatter_reduce(1, merged_dst.expand(-1, -1, channels), moving, reduce="mean")
+        return torch.cat([unmerged, dst], dim=1)
+
+    def unmerge(x):
+        channels = x.shape[-1]
+        unmerged, dst = x[:, : kept.shape[1]], x[:, kept.shape[1] :]
+        out = torch.empty(batch, tokens, channels, device=x.device, dtype=x.dtype)
+        out.scatter_(1, dst_idx.expand(batch, -1, channels), dst)
+        kept_idx = src_idx.expand(batch, -1, 1).gather(1, kept)
+        out.scatter_(1, kept_idx.expand(-1, -1, channels), unmerged)
+        merged_idx = src_idx.expand(batch, -1, 1).gather(1, merged)
+        out.scatter_(1, merged_idx.expand(-1, -1, channels), dst.gather(1, merged_dst.expand(-1, -1, channels)))
+        return out
+
+    return merge, unmerge
+
+
+class TokenMerging:
+    """Context manager that merges redundant tokens around a UNet's self-attention"""
+
+    def __init__(self, unet, ratio=TOME_RATIO, max_downsample=TOME_MAX_DOWNSAMPLE, seed=0):
+        if not 0 <= ratio < 1:
+            raise ValueError(f"Token merging ratio must be in [0, 1), got {ratio}")
+        self.unet = unet
+        self.ratio = ratio
+        self.max_downsample = max_downsample
+        self.seed = seed
+        self.generator = None
+        self.latent_size = None
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.hook = None
+        self.saved_forwards = {}
+
+    def __enter__(self):
+        self.generator = torch.Generator().manual_seed(self.seed)
+        self.hook = self.unet.register_forward_pre_hook(self._record_size, with_kwargs=True)
+        for module in self.unet.modules():
+            attention = getattr(module, "attn1", None)
+            if attention is not None and not getattr(module, "only_cross_attention", False):
+                self.saved_forwards[attention] = attention.__dict__.get("forward")
+                attention.forward = self._wrap_attention(attention.forward)
+        return self
+
+    def __exit__(self, *exc):
+        self.hook.remove()
+        for module, forward in self.saved_forwards.items():
+            if forward is None:
+                del module.forward
+            else:
+                module.forward = forward
+        self.saved_forwards.clear()
+
+    def _record_size(self, module, args, kwargs):
+        sample = args[0] if args else kwargs["sample"]
+        self.latent_size = tuple(sample.shape[-2:])
+
+    def _wrap_attention(self, forward):
+        def merged_attention_forward(hidden_states, *args, **kwargs):
+            merge = None
+            if hidden_states.ndim == 3:
+                height, width = self.latent_size
+                tokens = hidden_states.shape[1]
+                downsample = math.ceil(math.sqrt(height * width / tokens))
+                height, width = math.ceil(height / downsample), math.ceil(width / downsample)
+                if downsample <= self.max_downsample and height * width == tokens:
+                    merge, unmerge = bipartite_soft_matching(
+                        hidden_states, width, height, int(tokens * self.ratio), self.generator
+                    )
+            if merge is None:
+                return forward(hidden_states, *args, **kwargs)
+            merged = merge(hidden_states)
+            self.tokens_in += tokens
+            self.tokens_out += merged.shape[1]
+            return unmerge(forward(merged, *args, **kwargs))
+
+        return merged_attention_forward
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+AI Generator Worker Pool
+Runs K AIAvatarGenerator processes side by side on one machine. Each worker
+is pinned to its own set of cores (split along NUMA nodes where the OS
+exposes them) and memory-maps the same safetensors weights, so RAM does not
+grow K-fold. Each prompt is handed to the next idle worker, one job per
+worker at a time, which balances load and lets the pool know which job every
+worker holds. A worker that dies in the middle of a job (OOM kill, crash in
+native code) fails that job's Future and is replaced, up to MAX_RESPAWNS
+times per pool.
+
+Usage:
+    python worker_pool.py --workers 4 "a brave knight" "an elf archer"
+"""
+
+import argparse
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, wait
+from datetime import datetime
+from pathlib import Path
+
+# NUMA topology exported by Linux
+NUMA_NODE_DIR = Path("/sys/devices/system/node")
+
+# Dead workers replaced before the pool gives up on them
+MAX_RESPAWNS = 3
+
+# How often the collector checks that workers are alive (seconds)
+WATCHDOG_INTERVAL = 1.0
+
+
+def _parse_cpulist(text):
+    """Parse a kernel cpulist such as '0-3,8-11'"""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def numa_nodes():
+    """CPUs usable by this process, grouped by NUMA node"""
+    if hasattr(os, "sched_getaffinity"):
+        allowed = os.sched_getaffinity(0)
+    else:
+        allowed = set(range(os.cpu_count() or 1))
+
+    nodes = []
+    for node in sorted(NUMA_NODE_DIR.glob("node[0-9]*")):
+        try:
+            cpus = [cpu for cpu in _parse_cpulist((node / "cpulist").read_text()) if cpu in allowed]
+        except OSError:
+            continue
+        if cpus:
+            nodes.append(cpus)
+    return nodes or [sorted(allowed)]
+
+
+def plan_core_sets(num_workers, nodes=None):
+    """Split the machine's cores into num_workers disjoint sets
+
+    Workers are spread round-robin over NUMA nodes and each node's cores are
+    divided evenly among the workers placed on it, so a worker never spans
+    two nodes.
+    """
+    nodes = nodes or numa_nodes()
+    placement = [[] for _ in nodes]
+    for worker in range(num_workers):
+        placement[worker % len(nodes)].append(worker)
+
+    core_sets = [None] * num_workers
+    for cpus, workers in zip(nodes, placement):
+        for index, worker in enumerate(workers):
+            share = len(cpus) / len(workers)
+            chunk = cpus[int(index * share) : int((index + 1) * share)]
+            # More workers than cores on this node: workers share single cores
+            core_sets[worker] = chunk or [cpus[index % len(cpus)]]
+    return core_sets
+
+
+def _worker_main(worker_id, cores, generator_kwargs, tasks, results):
+    """Worker process: pin, load the model once, then serve its tasks until None"""
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    os.environ["OMP_NUM_THREADS"] = str(len(cores))
+    os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+
+    import torch
+
+    torch.set_num_threads(len(cores))
+
+    from ai_avatar_generator import AIAvatarGenerator
+
+    generator = AIAvatarGenerator(mmap_weights=True, **generator_kwargs)
+    generator.load_model()
+    results.send(("ready", worker_id, generator.model_loaded))
+    if not generator.model_loaded:
+        return
+
+    for job_id, method, args, kwargs in iter(tasks.get, None):
+        try:
+            image = getattr(generator, method)(*args, **kwargs)
+            results.send(("result", job_id, image))
+        except Exception as e:
+            results.send(("error", job_id, repr(e)))
+
+
+class GeneratorPool:
+    """Dispatches generation requests across pinned worker processes"""
+
+    def __init__(self, num_workers=None, **generator_kwargs):
+        self.num_workers = num_workers or len(numa_nodes())
+        self.generator_kwargs = generator_kwargs
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = []
+        self.core_sets = []
+        # One task queue and one result pipe per worker, replaced when the worker is
+        # respawned; a worker killed while writing can only break its own channels
+        self.task_queues = []
+        self.connections = []
+        self.backlog = deque()  # tasks waiting for an idle worker
+        self.idle = set()  # worker ids ready for their next task
+        self.running = {}  # worker id -> job id it was handed
+        self.retired = set()  # worker ids that are dead and not replaced
+        self.respawns = 0
+        self.closing = False
+        self.stopping = False
+        self.futures = {}
+        self.job_ids = itertools.count()
+        self.lock = threading.Lock()
+        self.collector = None
+        self.started_at = None
+        self.completed = 0
+
+    def start(self):
+        """Spawn the workers and wait until every model is loaded"""
+        self.core_sets = plan_core_sets(self.num_workers)
+        self.task_queues = [None] * len(self.core_sets)
+        self.connections = [None] * len(self.core_sets)
+        for worker_id, cores in enumerate(self.core_sets):
+            print(f"🧵 Worker {worker_id}: cores {cores[0]}-{cores[-1]} ({len(cores)} cores)")
+            self.processes.append(self._spawn(worker_id))
+
+        ready = 0
+        pending = set(range(len(self.processes)))
+        while pending:
+            for worker_id, (_, _, loaded) in self._receive(timeout=1):
+                pending.discard(worker_id)
+                if loaded:
+                    ready += 1
+                    self.idle.add(worker_id)
+                else:
+                    print(f"❌ Worker {worker_id} failed to load the model")
+                    self.retired.add(worker_id)
+            # A worker that died before reporting (e.g. missing libraries) never will
+            for worker_id in list(pending):
+                if not self.processes[worker_id].is_alive() and self.connections[worker_id] is None:
+                    print(f"❌ Worker {worker_id} exited during startup")
+                    pending.discard(worker_id)
+                    self.retired.add(worker_id)
+        if not ready:
+            self.close()
+            raise RuntimeError("No worker could load the model")
+        print(f"✅ {ready} workers ready")
+
+        self.collector = threading.Thread(target=self._collect, daemon=True)
+        self.collector.start()
+        self.started_at = time.perf_counter()
+        return self
+
+    def _spawn(self, worker_id):
+        # Fresh channels, so a replacement never sees tasks meant for the dead worker
+        if self.connections[worker_id] is not None:
+            self.connections[worker_id].close()
+        self.task_queues[worker_id] = self.context.Queue()
+        receiver, sender = self.context.Pipe(duplex=False)
+        process = self.context.Process(
+            target=_worker_main,
+            args=(worker_id, self.core_sets[worker_id], self.generator_kwargs, self.task_queues[worker_id], sender),
+            daemon=True,
+        )
+        process.start()
+        # Only the worker holds the sending end now, so its exit shows up as EOF
+        sender.close()
+        self.connections[worker_id] = receiver
+        return process
+
+    def _receive(self, timeout):
+        """Messages that arrive from any worker within timeout, as (worker id, message)"""
+        readers = {conn: worker_id for worker_id, conn in enumerate(self.connections) if conn is not None}
+        messages = []
+        for conn in multiprocessing.connection.wait(list(readers), timeout):
+            worker_id = readers[conn]
+            try:
+                messages.append((worker_id, conn.recv()))
+            except (EOFError, OSError):
+                # The worker exited; _check_workers finds out why
+                conn.close()
+                self.connections[worker_id] = None
+        return messages
+
+    def _collect(self):
+        """Resolve futures as results arrive from any worker, and watch for dead workers"""
+        while True:
+            messages = self._receive(timeout=WATCHDOG_INTERVAL)
+            for _, message in messages:
+                self._handle(*message)
+            # Workers have exited once stopping is set, so nothing more can arrive
+            if self.stopping and not messages:
+                return
+            self._check_workers()
+
+    def _handle(self, kind, job_id, payload):
+        if kind == "ready":
+            # A respawned worker finished loading (job_id is its worker id)
+            if not payload:
+                print(f"❌ Worker {job_id} failed to load the model")
+                self.retired.add(job_id)
+                return
+            with self.lock:
+                self.idle.add(job_id)
+                self._dispatch()
+            return
+        with self.lock:
+            for worker_id, running_job in list(self.running.items()):
+                if running_job == job_id:
+                    del self.running[worker_id]
+                    self.idle.add(worker_id)
+            self._dispatch()
+            future = self.futures.pop(job_id, None)
+            if kind == "result":
+                self.completed += 1
+        if future is None:
+            return
+        if kind == "result":
+            future.set_result(payload)
+        else:
+            future.set_exception(RuntimeError(payload))
+
+    def _check_workers(self):
+        """Fail the job of any worker that died mid-generation, then replace the worker"""
+        if self.closing:
+            return
+        for worker_id, process in enumerate(self.processes):
+            if worker_id in self.retired or process.is_alive():
+                continue
+            with self.lock:
+                self.idle.discard(worker_id)
+                job_id = self.running.pop(worker_id, None)
+                future = self.futures.pop(job_id, None)
+            print(f"❌ Worker {worker_id} died (exit code {process.exitcode})")
+            if future is not None:
+                future.set_exception(
+                    RuntimeError(f"Worker {worker_id} died (exit code {process.exitcode}) while generating")
+                )
+            if self.respawns < MAX_RESPAWNS:
+                self.respawns += 1
+                print(f"🔁 Respawning worker {worker_id} ({self.respawns}/{MAX_RESPAWNS})")
+                self.processes[worker_id] = self._spawn(worker_id)
+            else:
+                self.retired.add(worker_id)
+
+        if len(self.retired) == len(self.processes):
+            # Nobody is left to take queued jobs
+            with self.lock:
+                futures = list(self.futures.values())
+                self.futures.clear()
+                self.backlog.clear()
+            for future in futures:
+                future.set_exception(RuntimeError("Every pool worker has died"))
+
+    def submit(self, prompt, *args, **kwargs):
+        """Queue a generate_avatar call; returns a Future for the image"""
+        return self._submit("generate_avatar", (prompt,) + args, kwargs)
+
+    def submit_variation(self, image, prompt, **kwargs):
+        """Queue a generate_variation call; returns a Future for the image"""
+        return self._submit("generate_variation", (image, prompt), kwargs)
+
+    def _submit(self, method, args, kwargs):
+        future = Future()
+        # perf_counter is a system-wide monotonic clock, so workers can compute queue wait
+        kwargs.setdefault("queued_at", time.perf_counter())
+        with self.lock:
+            job_id = next(self.job_ids)
+            self.futures[job_id] = future
+            self.backlog.append((job_id, method, args, kwargs))
+            self._dispatch()
+        return future
+
+    def _dispatch(self):
+        """Hand backlog tasks to idle workers; call with self.lock held"""
+        while self.backlog and self.idle:
+            worker_id = self.idle.pop()
+            task = self.backlog.popleft()
+            # Recorded before the worker sees it, so a death at any point fails this job
+            self.running[worker_id] = task[0]
+            self.task_queues[worker_id].put(task)
+
+    def map(self, prompts, **kwargs):
+        """Generate every prompt and return the images in order"""
+        futures = [self.submit(prompt, **kwargs) for prompt in prompts]
+        return [future.result() for future in futures]
+
+    def images_per_hour(self):
+        """Aggregate throughput since the pool became ready"""
+        if not self.started_at:
+            return 0.0
+        elapsed = time.perf_counter() - self.started_at
+        return self.completed * 3600 / elapsed if elapsed > 0 else 0.0
+
+    def close(self):
+        """Finish the submitted jobs, then stop all workers"""
+        with self.lock:
+            futures = list(self.futures.values())
+        if self.collector is not None:
+            # Every job either completes or fails when its worker dies
+            wait(futures)
+        self.closing = True  # workers exiting now are not deaths to recover from
+        for tasks in self.task_queues:
+            tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+        self.stopping = True
+        if self.collector is not None:
+            self.collector.join(timeout=5)
+        for conn in self.connections:
+            if conn is not None:
+                conn.close()
+        self.processes = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate characters on a pool of pinned worker processes")
+    parser.add_argument("prompts", nargs="+", help="Character prompts to generate")
+    parser.add_argument("--workers", type=int, help="Number of worker processes (default: one per NUMA node)")
+    parser.add_argument("--seed", type=int, help="Base seed; prompt i uses seed + i")
+    args = parser.parse_args()
+
+    output_dir = Path("output")
+    output_dir.mkdir(exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    with GeneratorPool(args.workers) as pool:
+        futures = [
+            pool.submit(prompt, seed=None if args.seed is None else args.seed + i)
+            for i, prompt in enumerate(args.prompts)
+        ]
+        for i, (prompt, future) in enumerate(zip(args.prompts, futures)):
+            try:
+                image = future.result()
+            except RuntimeError as e:
+                print(f"❌ Failed: {prompt} ({e})")
+                continue
+            if image is None:
+                print(f"❌ Failed: {prompt}")
+                continue
+            filename = output_dir / f"pixel_fantasy_character_{timestamp}_{i:03d}.png"
+            image.save(str(filename))
+            print(f"✅ Character saved: {filename}")
+        print(f"📈 Throughput: {pool.images_per_hour():.1f} images/hour")
+
+
+if __name__ == "__main__":
+    sys.exit(main())